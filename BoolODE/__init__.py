@@ -3,6 +3,7 @@ import sys
 import yaml
 import argparse
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List
@@ -16,12 +17,20 @@ class GlobalSettings(object):
     def __init__(self,
                  model_dir, output_dir,
                  do_simulations, do_post_processing,
-                 modeltype) -> None:
+                 modeltype,
+                 num_workers=None, chunksize=None,
+                 start_method=None, max_concurrent_jobs=1,
+                 do_attractor_analysis=False) -> None:
         self.model_dir = model_dir
         self.output_dir = output_dir
         self.do_simulations = do_simulations
         self.do_post_processing = do_post_processing
         self.modeltype = modeltype
+        self.num_workers = num_workers
+        self.chunksize = chunksize
+        self.start_method = start_method
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.do_attractor_analysis = do_attractor_analysis
 
 class JobSettings(object):
     '''
@@ -79,10 +88,26 @@ class BoolODE(object):
             data['sample_cells'] = job.get('sample_cells',False)
             data['nClusters'] = job.get('nClusters',1)
             data['doParallel'] = job.get('do_parallel',False)            
+            data['ensemble'] = job.get('ensemble',False)
+            data['batch_size'] = job.get('batch_size',1000)
             data['identical_pars'] = job.get('identical_pars',False)
             data['sample_pars'] = job.get('sample_pars',False)
             data['sample_std'] = job.get('sample_std',0.1)
+            data['sample_cell_pars'] = job.get('sample_cell_pars',False)
             data['integration_step_size'] = job.get('integration_step_size',0.01)            
+            data['seed'] = job.get('seed',0)
+            data['boundary'] = job.get('boundary_policy','hold')
+            data['noise_chunk_size'] = job.get('noise_chunk_size',1000)
+            data['record_every'] = job.get('record_every',1)
+            data['early_rejection'] = job.get('early_rejection',True)
+            data['integrator'] = job.get('integrator','euler')
+            data['rtol'] = job.get('rtol',5e-2)
+            data['atol'] = job.get('atol',5e-2)
+            data['milstein'] = job.get('milstein',False)
+            data['implicit_degradation'] = job.get('implicit_degradation',False)
+            data['deterministic'] = job.get('deterministic',False)
+            data['analytic_jacobian'] = job.get('analytic_jacobian',True)
+            data['trajectory_store'] = job.get('trajectory_store','csv')
             # Optional Settings
             data['parameter_inputs_path'] = Path(self.global_settings.model_dir,\
                                                  job.get('parameter_inputs_path',''))
@@ -99,16 +124,33 @@ class BoolODE(object):
             data['add_dummy'] = job.get('add_dummy',False)
             data['max_parents'] = job.get('max_parents',1)
             data['modeltype'] = self.global_settings.modeltype
+            data['hill_form'] = job.get('hill_form','expanded')
+            data['model_cache'] = job.get('model_cache',False)
+            data['write_model'] = job.get('write_model',True)
+            data['model_engine'] = job.get('model_engine','source')
+            # Worker pool settings, shared by all jobs
+            data['num_workers'] = self.global_settings.num_workers
+            data['chunksize'] = self.global_settings.chunksize
+            data['start_method'] = self.global_settings.start_method
 
             jobs[jobid] = data
         return(jobs)
 
-    def execute_jobs(self, parallel=False, num_threads=1):
+    def execute_jobs(self, parallel=False, num_threads=None):
         '''
         Run each user specified job. 
-        BoolODE runs two types of functions
-        1. If `do_simulation == TRUE`, perform SDE simulations of model specified as Boolean rules. 
-        2. If `do_post_processing == TRUE` perform the list of post processing operations specified.
+        BoolODE runs three types of functions
+        1. If `do_attractor_analysis == TRUE`, find the attractors of the model, and recommend `nClusters` and `simulation_time`.
+        2. If `do_simulation == TRUE`, perform SDE simulations of model specified as Boolean rules. 
+        3. If `do_post_processing == TRUE` perform the list of post processing operations specified.
+
+        A single pool of worker processes is shared by all jobs with `do_parallel: True`.
+        Its size is set by `num_workers` in the global settings, or by num_threads if specified.
+        Up to `max_concurrent_jobs` jobs are run at the same time, in separate threads.
+        If several jobs are run at the same time, the jobs that simulate their cells in
+        a single process (see run_experiment.simulationMode()) are each run in a
+        process of the pool, since threads running Python code do not run in parallel.
+        Jobs that use the pool are run in the main process.
 
         .. warning::
             This function automatically creates folders for each job name 
@@ -124,10 +166,44 @@ class BoolODE(object):
             if not os.path.exists(outdir):
                 print(outdir, "does not exist, creating it...")
                 os.makedirs(outdir)
+        if self.global_settings.do_attractor_analysis:
+            print('Starting attractor analysis')
+            for jobid in alljobs:
+                runexp.startAttractorAnalysis(self.jobs[jobid])
         if self.global_settings.do_simulations:
             print('Starting simulations')
-            for jobid in alljobs:
-                runexp.startRun(self.jobs[jobid])
+            pool = None
+            concurrent = self.global_settings.max_concurrent_jobs > 1 and len(alljobs) > 1
+            usesPool = {jobid:runexp.simulationMode(self.jobs[jobid]) == 'parallel'\
+                        for jobid in alljobs}
+            if any(usesPool.values()) or concurrent:
+                num_workers = self.global_settings.num_workers
+                if num_threads is not None:
+                    num_workers = num_threads
+                num_workers = num_workers or os.cpu_count()
+                pool = runexp.createPool(num_workers,
+                                         self.global_settings.start_method)
+                # Jobs split their cells according to the size of the pool
+                for jobid in alljobs:
+                    self.jobs[jobid]['num_workers'] = num_workers
+            try:
+                ## Jobs write to separate output folders, and can be run
+                ## concurrently. Simulations of jobs with do_parallel
+                ## all run in the same pool of worker processes.
+                def runJob(jobid):
+                    if usesPool[jobid] or not concurrent:
+                        return runexp.startRun(self.jobs[jobid], pool=pool)
+                    # The job is simulated in one worker of the pool,
+                    # in parallel with the other jobs
+                    return pool.apply(runexp.startRun, (self.jobs[jobid],))
+                with ThreadPoolExecutor(max_workers=self.global_settings.max_concurrent_jobs) as executor:
+                    runs = [executor.submit(runJob, jobid) for jobid in alljobs]
+                    for run in runs:
+                        run.result()
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
         if self.global_settings.do_post_processing:
             print('Starting post processing')
             self.do_post_processing()
@@ -163,6 +239,13 @@ class BoolODE(object):
                 gensample_jobs = self.post_settings.gensample_jobs
             for gsamp in gensample_jobs:
                 for jobid in alljobs:
+                    if self.jobs[jobid]['trajectory_store'] == 'none':
+                        # Simulation folders may hold the csv files of an earlier run
+                        print(self.jobs[jobid]['name'], ": trajectories are not stored with"
+                              " `trajectory_store: 'none'`, skipping post processing."
+                              " Use 'csv' or 'npy' to generate samples.")
+                        generatedPaths[jobid] = []
+                        continue
                     settings = {}
                     settings['num_cells'] = self.jobs[jobid]['num_cells']
                     settings['sample_size'] = gsamp.get('sample_size', 100)
@@ -170,14 +253,15 @@ class BoolODE(object):
                     settings['nDatasets'] = gsamp.get('nDatasets', 1)
                     settings['name'] = self.jobs[jobid]['name']
                     settings['nClusters'] = self.jobs[jobid]['nClusters']
+                    settings['seed'] = self.jobs[jobid]['seed']
                     generatedPaths[jobid] = po.genSamples(settings)
         
         if self.post_settings.dropout_jobs is not None:
             print('Starting genDropouts...')
-            for drop in self.post_settings.dropout_jobs:
+            for dropid, drop in enumerate(self.post_settings.dropout_jobs):
                 num_invalid = 0
                 for jobid in alljobs:
-                    for gsampPath in generatedPaths[jobid]:
+                    for did, gsampPath in enumerate(generatedPaths[jobid]):
                         settings = {}
                         invalid = False
                         settings['outPrefix'] = gsampPath 
@@ -192,6 +276,8 @@ class BoolODE(object):
                         settings['num_cells'] = self.jobs[jobid]['num_cells']
                         settings['drop_cutoff'] = drop.get('drop_cutoff', 0.0)
                         settings['drop_prob'] = drop.get('drop_prob', 0.0)
+                        settings['seed'] = self.jobs[jobid]['seed']
+                        settings['stream'] = (dropid, did)
 
                         for filetype in ['expr', 'pseudo', 'refNet']:
                             if not settings[filetype].is_file():
@@ -331,11 +417,21 @@ class ConfigParser(object):
         do_simulations = input_settings_map['do_simulations']
         do_post_processing = input_settings_map['do_post_processing']
         modeltype = input_settings_map['modeltype']
+        num_workers = input_settings_map.get('num_workers', None)
+        chunksize = input_settings_map.get('chunksize', None)
+        start_method = input_settings_map.get('start_method', None)
+        max_concurrent_jobs = input_settings_map.get('max_concurrent_jobs', 1)
+        do_attractor_analysis = input_settings_map.get('do_attractor_analysis', False)
         return GlobalSettings(model_dir,
                               output_dir,
                               do_simulations,
                               do_post_processing,
-                              modeltype)
+                              modeltype,
+                              num_workers=num_workers,
+                              chunksize=chunksize,
+                              start_method=start_method,
+                              max_concurrent_jobs=max_concurrent_jobs,
+                              do_attractor_analysis=do_attractor_analysis)
     @staticmethod
     def __parse_postproc_settings(input_settings_map) -> GlobalSettings:
         dropout_jobs = input_settings_map.get('Dropouts', None)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+import pandas as pd
+from pathlib import Path
+# local imports
+from BoolODE import utils
+from BoolODE import simulator
+from BoolODE.compiled_model import CompiledModel
+
+class BooleanNetwork:
+    """Synchronous Boolean dynamics of the rules of a model, in which
+    all nodes are updated at once. States are stored as bitsets, with
+    one row of 64 bit words per state, where bit j of the state is
+    the value of node j, so that many states are updated together.
+
+    Nodes without rules that are treated as parameter inputs
+    (see GenerateModel.addParameterInputs()) are constant, and are
+    ON if their value is above the Hill threshold.
+
+    :param mg: Model details obtained by instantiating an object of GenerateModel
+    :type mg: BoolODE.GenerateModel
+    """
+    def __init__(self, mg) -> None:
+        self.nodes = list(mg.df['Gene'].values)
+        self.rules = [utils.compileRule(rule) for rule in mg.df['Rule'].values]
+        self.numWords = (len(self.nodes) + 63)//64
+        hillThreshold = mg.kineticParameterDefaults['hillThreshold']
+        self.inputs = {n:np.bool_(mg.ModelSpec['pars'].get(n, 0.) > hillThreshold)\
+                       for n in mg.withoutRules}
+
+    def decode(self, states):
+        """
+        :param states: Array of bitsets, of shape (number of states, numWords)
+        :type states: ndarray
+        :returns:
+            - values: Boolean array of shape (number of states, number of nodes)
+        """
+        j = np.arange(len(self.nodes))
+        return ((states[:, j//64] >> (j % 64).astype(np.uint64)) & np.uint64(1)).astype(bool)
+
+    def encode(self, values):
+        """
+        Inverse of decode().
+        """
+        states = np.zeros((len(values), self.numWords), dtype=np.uint64)
+        for j in range(len(self.nodes)):
+            states[:, j//64] |= values[:, j].astype(np.uint64) << np.uint64(j % 64)
+        return states
+
+    def update(self, states):
+        """
+        Applies the rules to every state at once.
+
+        :param states: Array of bitsets, of shape (number of states, numWords)
+        :type states: ndarray
+        :returns:
+            - next: The next state of each state
+        """
+        values = self.decode(states)
+        namespace = {n:values[:, j] for j, n in enumerate(self.nodes)}
+        namespace.update(self.inputs)
+        nextValues = np.empty_like(values)
+        for j, (code, names) in enumerate(self.rules):
+            nextValues[:, j] = np.broadcast_to(utils.evaluateRule(code, names, namespace),
+                                               (len(states),))
+        return self.encode(nextValues)
+
+def lexicographicMin(a, b):
+    """
+    Returns the smaller of each pair of rows of a and b,
+    comparing the words from the last, most significant one.
+    """
+    smaller = np.zeros(len(a), dtype=bool)
+    decided = np.zeros(len(a), dtype=bool)
+    for w in reversed(range(a.shape[1])):
+        smaller |= ~decided & (a[:, w] < b[:, w])
+        decided |= a[:, w] != b[:, w]
+    return np.where(smaller[:, None], a, b)
+
+def booleanAttractors(mg, maxNodes=20, numSamples=10000, maxSteps=10000, rng=None):
+    """
+    Finds the attractors of the synchronous Boolean dynamics of the rules,
+    i.e. fixed points and cycles. If the network has at most maxNodes nodes,
+    every state is followed, and the basin of each attractor is exact.
+    Otherwise, numSamples random states are followed, and the basins are
+    estimated from them. All states are followed together, until each
+    reaches its attractor, which is detected as in Floyd's cycle finding
+    algorithm: a state advanced by one step at a time meets the same
+    state advanced by two steps at a time.
+
+    :param mg: Model details obtained by instantiating an object of GenerateModel
+    :type mg: BoolODE.GenerateModel
+    :param maxNodes: Largest number of nodes for which all states are followed
+    :type maxNodes: int
+    :param numSamples: Number of random states followed in larger networks
+    :type numSamples: int
+    :param maxSteps: Largest number of steps taken to reach an attractor
+    :type maxSteps: int
+    :param rng: Random number generator used to sample states
+    :type rng: numpy.random.Generator
+    :returns:
+        - nodes: List of names of the nodes
+        - attractors: List of tuples (states, basin), one per attractor, sorted by decreasing basin. states is a boolean array of shape (length of the cycle, number of nodes), with one row for a fixed point, and basin is the fraction of the followed states reaching the attractor.
+    """
+    network = BooleanNetwork(mg)
+    numNodes = len(network.nodes)
+    if numNodes <= maxNodes:
+        states = np.arange(2**numNodes, dtype=np.uint64)[:, None]
+    else:
+        if rng is None:
+            rng = np.random.default_rng()
+        states = network.encode(rng.random((numSamples, numNodes)) < 0.5)
+    ## Floyd's algorithm, applied to the states
+    ## that have not reached their attractor yet
+    slow = network.update(states)
+    fast = network.update(slow)
+    active = np.flatnonzero((slow != fast).any(axis=1))
+    steps = 0
+    while len(active) > 0:
+        if steps == maxSteps:
+            raise RuntimeError("%d states did not reach an attractor in %d steps"\
+                               % (len(active), maxSteps))
+        slow[active] = network.update(slow[active])
+        fast[active] = network.update(network.update(fast[active]))
+        active = active[(slow[active] != fast[active]).any(axis=1)]
+        steps += 1
+    ## Every state in fast is on a cycle, which is labeled
+    ## by its smallest state, found by going around the cycle
+    onCycle = np.unique(fast, axis=0)
+    label = onCycle.copy()
+    current = network.update(onCycle)
+    active = np.flatnonzero((current != onCycle).any(axis=1))
+    while len(active) > 0:
+        label[active] = lexicographicMin(label[active], current[active])
+        current[active] = network.update(current[active])
+        active = active[(current[active] != onCycle[active]).any(axis=1)]
+    ## Number of followed states reaching each cycle state
+    _, cycleBasin = np.unique(fast, axis=0, return_counts=True)
+    labels, attractor = np.unique(label, axis=0, return_inverse=True)
+    basin = np.bincount(attractor.ravel(), weights=cycleBasin)
+    attractors = []
+    for a in np.argsort(-basin, kind='stable'):
+        cycle = [labels[a:a + 1]]
+        while True:
+            state = network.update(cycle[-1])
+            if (state == cycle[0]).all():
+                break
+            cycle.append(state)
+        attractors.append((network.decode(np.concatenate(cycle)), basin[a]/len(states)))
+    return network.nodes, attractors
+
+def steadyStates(mg, nodes, fixedPoints, tol=1e-8, maxIterations=100):
+    """
+    Locates the steady states of the ODE model corresponding to Boolean
+    fixed points, with Newton's method. The iterations start from the
+    values of the variables when every node is fully ON or OFF, and the
+    steady states are refined together using the analytic Jacobian of the
+    model (see CompiledModel.jacobian()). Their stability is given by the
+    eigenvalues of the Jacobian.
+
+    :param mg: Model details obtained by instantiating an object of GenerateModel
+    :type mg: BoolODE.GenerateModel
+    :param nodes: List of names of the nodes, see booleanAttractors()
+    :type nodes: list
+    :param fixedPoints: Boolean array of shape (number of fixed points, number of nodes)
+    :type fixedPoints: ndarray
+    :param tol: The iterations stop once the largest derivative is below tol
+    :type tol: float
+    :param maxIterations: Largest number of Newton iterations
+    :type maxIterations: int
+    :returns:
+        - Y: Steady states, of shape (number of steady states, d). Fixed points whose iterations did not converge, and duplicate steady states, are dropped.
+        - origin: Index of the fixed point each steady state was found from
+        - stable: True for the steady states at which all eigenvalues have a negative real part
+        - relaxation: Relaxation time of each steady state, 1/|largest real part of the eigenvalues|, inf if it is 0
+    """
+    Model = CompiledModel(mg)
+    parNames = sorted(mg.ModelSpec['pars'].keys())
+    pars = np.array([mg.ModelSpec['pars'][k] for k in parNames], dtype=float)
+    varindex = {v:i for i, v in mg.varmapper.items()}
+    def ratio(production, degradation):
+        # Without degradation the guess is the production rate
+        return production/degradation if degradation != 0 else production
+    ## Initial guess, with regulatory functions equal to 0 or 1
+    Y = np.zeros((len(varindex), len(fixedPoints)))
+    for j, node in enumerate(nodes):
+        on = fixedPoints[:, j].astype(float)
+        if node in mg.proteinlist:
+            Y[varindex['p_' + node]] = on*pars[parNames.index('y_max')]
+        else:
+            x = on*ratio(pars[parNames.index('m_' + node)], pars[parNames.index('l_x_' + node)])
+            Y[varindex['x_' + node]] = x
+            Y[varindex['p_' + node]] = x*ratio(pars[parNames.index('r_' + node)],
+                                               pars[parNames.index('l_p_' + node)])
+    # Products of many small Hill functions underflow harmlessly
+    with np.errstate(under='ignore'):
+        for iteration in range(maxIterations):
+            F = Model(Y, 0, pars)
+            if np.abs(F).max() < tol:
+                break
+            J = Model.jacobian(Y, 0, pars).transpose(2, 0, 1)
+            step = -(np.linalg.pinv(J) @ F.T[:, :, None])[:, :, 0].T
+            Ynext = Y + step
+            # Variables stay nonnegative, instead of crossing 0
+            # the step stops halfway to 0
+            Y = np.where(Ynext < 0, 0.5*Y, Ynext)
+        F = Model(Y, 0, pars)
+        J = Model.jacobian(Y, 0, pars).transpose(2, 0, 1)
+    converged = np.abs(F).max(axis=0) < tol
+    ## Steady states found from several fixed points are kept once
+    scale = max(np.abs(Y).max(), 1.)
+    _, keep = np.unique(np.round(Y[:, converged].T/scale, 6), axis=0, return_index=True)
+    origin = np.flatnonzero(converged)[np.sort(keep)]
+    growth = np.linalg.eigvals(J[origin]).real.max(axis=1)
+    # Perturbations of marginally stable steady states do not decay
+    with np.errstate(divide='ignore'):
+        relaxation = np.where(growth != 0, 1./np.abs(growth), np.inf)
+    return Y[:, origin].T, origin, growth < 0, relaxation
+
+def arrivalTimes(mg, y0, targets, maxTime, stepSize=0.01, numRuns=20, tol=0.4,
+                 segment=10., seed=0):
+    """
+    Simulates numRuns cells with noise from y0, as in the simulations of
+    the job (see simulator.simulateModelEnsemble()), and returns the time
+    at which each cell first reaches one of the targets, i.e. all its mRNA
+    values are within tol*x_max of those of the target. The cells are
+    simulated segment time units at a time, until all have reached a
+    target or maxTime is reached.
+
+    :param mg: Model details obtained by instantiating an object of GenerateModel
+    :type mg: BoolODE.GenerateModel
+    :param y0: Initial condition
+    :type y0: list
+    :param targets: Steady states, of shape (number of targets, d)
+    :type targets: ndarray
+    :param maxTime: Longest simulated time
+    :type maxTime: float
+    :param stepSize: Integration step size
+    :type stepSize: float
+    :param seed: Seed of the random numbers of the cells, see utils.getGenerator()
+    :type seed: int
+    :returns:
+        - times: Array of length numRuns, nan for the cells that did not reach a target
+    """
+    Model = CompiledModel(mg)
+    parNames = sorted(mg.ModelSpec['pars'].keys())
+    pars = np.array([mg.ModelSpec['pars'][k] for k in parNames], dtype=float)
+    rnaIndex = [i for i, v in mg.varmapper.items() if 'x_' in v]
+    targets = targets[:, rnaIndex]
+    threshold = tol*mg.kineticParameterDefaults['x_max']
+    recordEvery = 10
+    numSteps = recordEvery*int(np.ceil(segment/stepSize/recordEvery))
+    rngs = [utils.getGenerator(seed, utils.ATTRACTOR_STREAM, 1 + run) for run in range(numRuns)]
+    times = np.full(numRuns, np.nan)
+    Y = np.tile(np.asarray(y0, dtype=float), (numRuns, 1))
+    pending = np.arange(numRuns)
+    start = 0.
+    while len(pending) > 0 and len(targets) > 0 and start < maxTime:
+        tspan = start + stepSize*np.arange(numSteps + 1)
+        # Products of many small Hill functions underflow harmlessly
+        with np.errstate(under='ignore'):
+            P = simulator.simulateModelEnsemble(Model, Y[pending], pars, tspan,
+                                                [rngs[run] for run in pending],
+                                                record_every=recordEvery)
+        ## Distance of every recorded state to the nearest target
+        distance = np.abs(P[:, :, None, rnaIndex] - targets[None, None]).max(axis=3).min(axis=2)
+        arrived = distance < threshold
+        reached = arrived.any(axis=0)
+        times[pending[reached]] = tspan[::recordEvery][arrived[:, reached].argmax(axis=0)]
+        Y[pending] = P[-1]
+        pending = pending[~reached]
+        start = tspan[-1]
+    return times
+
+def analyzeAttractors(mg, y0, maxTime=100., stepSize=0.01, maxNodes=20, numSamples=10000,
+                      numRuns=20, seed=0):
+    """
+    Finds the Boolean attractors of the model, see booleanAttractors(),
+    the ODE steady states corresponding to its fixed points,
+    see steadyStates(), and recommends the job settings nClusters and
+    simulation_time. nClusters is the number of stable steady states,
+    except those at which all mRNA values are below 10% of x_max, since
+    simulations going to such steady states are repeated (see
+    simulator.CollapseCheck).
+
+    simulation_time is the time by which 90% of numRuns simulations with
+    noise from the initial condition reach one of these steady states,
+    see arrivalTimes(), and at least 5 relaxation times of the slowest of
+    them, so that simulations reaching any of them are close to it.
+    No simulation_time is recommended (None) if fewer than 90% of the
+    simulations reach one by maxTime.
+
+    :param mg: Model details obtained by instantiating an object of GenerateModel
+    :type mg: BoolODE.GenerateModel
+    :param y0: Initial condition of the simulations
+    :type y0: list
+    :param maxTime: Longest simulation_time considered
+    :type maxTime: float
+    :param stepSize: Integration step size of the simulations
+    :type stepSize: float
+    :param seed: Seed of the random numbers, see utils.getGenerator()
+    :type seed: int
+    :returns:
+        - analysis: Dictionary containing the attractors ('nodes', 'attractors'), the steady states ('steadyStates', 'origin', 'stable', 'relaxation', 'collapsed'), the time at which each simulation reaches a steady state ('arrivalTimes') and the recommendations ('nClusters', 'simulation_time')
+    """
+    nodes, attractors = booleanAttractors(mg, maxNodes=maxNodes, numSamples=numSamples,
+                                          rng=utils.getGenerator(seed, utils.ATTRACTOR_STREAM, 0))
+    fixedPoints = [states[0] for states, basin in attractors if len(states) == 1]
+    if len(fixedPoints) > 0:
+        Y, origin, stable, relaxation = steadyStates(mg, nodes, np.array(fixedPoints))
+    else:
+        Y = np.zeros((0, len(mg.varmapper)))
+        origin = np.zeros(0, dtype=int)
+        stable = np.zeros(0, dtype=bool)
+        relaxation = np.zeros(0)
+    rnaIndex = [i for i, v in mg.varmapper.items() if 'x_' in v]
+    collapse = simulator.CollapseCheck(rnaIndex, 0.1*mg.kineticParameterDefaults['x_max'])
+    collapsed = np.asarray(collapse(Y[None]), dtype=bool).reshape(len(Y))
+    kept = stable & ~collapsed
+    arrival = arrivalTimes(mg, y0, Y[kept], maxTime, stepSize=stepSize,
+                           numRuns=numRuns, seed=seed)
+    if len(arrival) == 0 or np.isnan(arrival).mean() > 0.1:
+        simulationTime = None
+    else:
+        simulationTime = max([np.nanquantile(arrival, 0.9)] + list(5*relaxation[kept]))
+        simulationTime = float(np.ceil(round(min(simulationTime, maxTime), 6)))
+    return {'nodes':nodes,
+            'attractors':attractors,
+            'steadyStates':Y,
+            'origin':origin,
+            'stable':stable,
+            'relaxation':relaxation,
+            'collapsed':collapsed,
+            'arrivalTimes':arrival,
+            'nClusters':max(1, int(kept.sum())),
+            'simulation_time':simulationTime}
+
+def writeAttractors(analysis, mg, outPrefix):
+    """
+    Writes the Boolean attractors to BooleanAttractors.csv, with one row
+    per state of each attractor, and the ODE steady states to
+    SteadyStates.csv, with one row per steady state, in outPrefix.
+
+    :param analysis: Dictionary returned by analyzeAttractors()
+    :type analysis: dict
+    :param mg: Model details obtained by instantiating an object of GenerateModel
+    :type mg: BoolODE.GenerateModel
+    :param outPrefix: Output folder of the job
+    :type outPrefix: str
+    """
+    rows = []
+    for a, (states, basin) in enumerate(analysis['attractors']):
+        for state in states:
+            row = {'Attractor':a, 'Length':len(states), 'Basin':basin}
+            row.update({n:int(v) for n, v in zip(analysis['nodes'], state)})
+            rows.append(row)
+    pd.DataFrame(rows).to_csv(Path(outPrefix, 'BooleanAttractors.csv'), index=False)
+    fixedPoints = [a for a, (states, basin) in enumerate(analysis['attractors'])\
+                   if len(states) == 1]
+    steadyStatesDF = pd.DataFrame(analysis['steadyStates'],
+                                  columns=[mg.varmapper[i] for i in range(len(mg.varmapper))])
+    steadyStatesDF.insert(0, 'Attractor', [fixedPoints[o] for o in analysis['origin']])
+    steadyStatesDF.insert(1, 'Stable', analysis['stable'])
+    steadyStatesDF.insert(2, 'Collapsed', analysis['collapsed'])
+    steadyStatesDF.insert(3, 'RelaxationTime', analysis['relaxation'])
+    steadyStatesDF.to_csv(Path(outPrefix, 'SteadyStates.csv'), index=False)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+from scipy import sparse
+
+class KineticModel:
+    """Production and degradation of mRNA and protein, shared by the
+    array-based implementations of the ODE model constructed by
+    GenerateModel. The regulatory functions of the nodes are computed
+    by regulatoryFunctions(), which is implemented by the subclasses,
+    see CompiledModel and SparseModel.
+    """
+    def indexKinetics(self, mg, nodes, parindex, varindex):
+        """
+        Stores the indices of the variables and parameters describing the
+        production and degradation of mRNA and protein.
+
+        :param mg: Model details obtained by instantiating an object of GenerateModel
+        :type mg: BoolODE.GenerateModel
+        :param nodes: Names of the nodes, in the order of the regulatory functions
+        :type nodes: list
+        :param parindex: Mapper: {parameter name : index in pars}
+        :type parindex: dict
+        :param varindex: Mapper: {variable name : index in Y}
+        :type varindex: dict
+        """
+        ## Production and degradation of mRNA and protein
+        genes = [ni for ni, node in enumerate(nodes) if node not in mg.proteinlist]
+        self.geneNodes = np.array(genes, dtype=int)
+        self.geneX = np.array([varindex['x_' + nodes[ni]] for ni in genes], dtype=int)
+        self.geneP = np.array([varindex['p_' + nodes[ni]] for ni in genes], dtype=int)
+        self.mRNATranscription = np.array([parindex['m_' + nodes[ni]] for ni in genes], dtype=int)
+        self.mRNADegradation = np.array([parindex['l_x_' + nodes[ni]] for ni in genes], dtype=int)
+        self.proteinTranslation = np.array([parindex['r_' + nodes[ni]] for ni in genes], dtype=int)
+        self.proteinDegradation = np.array([parindex['l_p_' + nodes[ni]] for ni in genes], dtype=int)
+        ## Signaling proteins
+        proteins = [ni for ni, node in enumerate(nodes) if node in mg.proteinlist]
+        self.proteinNodes = np.array(proteins, dtype=int)
+        self.proteinP = np.array([varindex['p_' + nodes[ni]] for ni in proteins], dtype=int)
+        if len(proteins) > 0:
+            self.signalingTimescale = parindex['signalingtimescale']
+            self.yMax = parindex['y_max']
+        # Row of the Jacobian of the variable regulated by each node
+        self.nodeRow = np.zeros(len(nodes), dtype=int)
+        self.nodeRow[self.geneNodes] = self.geneX
+        self.nodeRow[self.proteinNodes] = self.proteinP
+
+    def __call__(self, Y, t, pars):
+        """
+        Computes the time derivatives of the model.
+
+        :param Y: Current model state. Either a vector, or an array with one row per state variable and one column per cell.
+        :type Y: ndarray
+        :param t: Current time
+        :type t: float
+        :param pars: List of parameter values, sorted by parameter name
+        :type pars: list
+        :returns:
+            - dY: Time derivatives, of the same shape as Y
+        """
+        Y = np.asarray(Y, dtype=float)
+        pars = np.asarray(pars, dtype=float)
+        if pars.ndim == 1 and Y.ndim > 1:
+            pars = pars.reshape(pars.shape + (1,)*(Y.ndim - 1))
+        f = self.regulatoryFunctions(Y, pars)
+        dY = np.empty_like(Y)
+        x = Y[self.geneX]
+        dY[self.geneX] = pars[self.mRNATranscription]*f[self.geneNodes]\
+            - pars[self.mRNADegradation]*x
+        dY[self.geneP] = pars[self.proteinTranslation]*x\
+            - pars[self.proteinDegradation]*Y[self.geneP]
+        if len(self.proteinNodes) > 0:
+            dY[self.proteinP] = pars[self.signalingTimescale]*(pars[self.yMax]*f[self.proteinNodes]\
+                                                                - Y[self.proteinP])
+        return dY
+
+class CompiledModel(KineticModel):
+    """Array-based implementation of the ODE model constructed by
+    GenerateModel.
+
+    The Model() function written to model.py unpacks every parameter and
+    every variable into a local, and evaluates one scalar expression per
+    variable. Instead, CompiledModel stores the structure of the model as
+    index arrays into the state and parameter vectors. Each regulatory
+    interaction (an *edge*) is evaluated once, and each term of a
+    regulatory function is the product of a fixed set of edges, so that
+    every call only performs a handful of array operations irrespective
+    of the size of the network.
+
+    In the compact form of the Hill model, each term is instead one of
+    disjoint sets of regulator states for which the Boolean rule is true
+    (see utils.disjointCover()), and is the product of h/(1+h) over the
+    regulators that are ON in the set, and 1/(1+h) over the regulators
+    that are OFF. Regulators whose state is free do not appear in the term.
+
+    An instance is called exactly like Model(), and returns the same
+    time derivatives. The Jacobian of the model is computed analytically
+    from the same structure, see jacobian().
+
+    :param mg: Model details obtained by instantiating an object of GenerateModel
+    :type mg: BoolODE.GenerateModel
+    """
+    def __init__(self, mg) -> None:
+        self.modeltype = mg.settings['modeltype']
+        self.compact = self.modeltype == 'hill' and mg.settings['hill_form'] == 'compact'
+        self.parNames = sorted(mg.ModelSpec['pars'].keys())
+        parindex = {p:i for i, p in enumerate(self.parNames)}
+        varindex = {v:i for i, v in mg.varmapper.items()}
+        self.numVars = len(varindex)
+        # Nodes are listed in the order of the rules
+        nodes = list(mg.regulation.keys())
+
+        ## Regulatory interactions, one per (target, regulator) pair
+        edges = {}
+        edgeNode = []
+        speciesEdges, speciesSource = [], []
+        inputEdges, inputSource = [], []
+        threshold, hillCoefficient = [], []
+        ## Terms of the regulatory functions, each a list of (edge, state) pairs
+        termEdges, termCoefficient, termNode = [], [], []
+        for ni, node in enumerate(nodes):
+            regulation = mg.regulation[node]
+            if self.compact:
+                terms = [(None, cube) for cube in regulation['cubes']]
+            else:
+                terms = [(coefficient, [(reg, True) for reg in combination])\
+                         for coefficient, combination in regulation['terms']]
+            for coefficient, combination in terms:
+                members = []
+                for reg, state in combination:
+                    if (node, reg) not in edges:
+                        edges[(node, reg)] = len(edges)
+                        edgeNode.append(ni)
+                        if reg in regulation['species']:
+                            speciesEdges.append(edges[(node, reg)])
+                            speciesSource.append(varindex['p_' + reg])
+                        else:
+                            inputEdges.append(edges[(node, reg)])
+                            inputSource.append(parindex[reg])
+                        if self.modeltype == 'hill':
+                            threshold.append(parindex[mg.getHillThresholdName(node, reg)])
+                            hillCoefficient.append(parindex['n_' + reg])
+                    members.append((edges[(node, reg)], state))
+                termEdges.append(members)
+                if coefficient is not None:
+                    termCoefficient.append(parindex[coefficient])
+                termNode.append(ni)
+        self.numEdges = len(edges)
+        # Values of the edges are followed by their complements
+        # in the compact form, and by a constant edge of value 1
+        self.constantEdge = 2*self.numEdges if self.compact else self.numEdges
+        self.speciesEdges = np.array(speciesEdges, dtype=int)
+        self.speciesSource = np.array(speciesSource, dtype=int)
+        self.inputEdges = np.array(inputEdges, dtype=int)
+        self.inputSource = np.array(inputSource, dtype=int)
+        self.threshold = np.array(threshold, dtype=int)
+        self.hillCoefficient = np.array(hillCoefficient, dtype=int)
+        # Terms with fewer regulators are padded with an index pointing
+        # to a constant edge of value 1
+        maxTermSize = max([len(members) for members in termEdges] + [1])
+        self.termEdges = np.full((len(termEdges), maxTermSize), self.constantEdge, dtype=int)
+        for ti, members in enumerate(termEdges):
+            self.termEdges[ti, :len(members)] = [e if state else e + self.numEdges\
+                                                 for e, state in members]
+        self.termCoefficient = np.array(termCoefficient, dtype=int)
+        self.termNode = np.array(termNode, dtype=int)
+        self.edgeNode = np.array(edgeNode, dtype=int)
+        # Maps every position in a term to its edge. In the compact form,
+        # positions holding the complement of an edge count negatively.
+        slots = self.termEdges.ravel()
+        sign = np.where(slots < self.numEdges, 1., -1.)
+        keep = slots < self.constantEdge
+        self.slotIncidence = sparse.csr_matrix((sign[keep],
+                                                (slots[keep] % max(self.numEdges, 1),
+                                                 np.arange(len(slots))[keep])),
+                                               shape=(self.numEdges, len(slots)))
+        # Sums the terms belonging to each node
+        self.incidence = sparse.csr_matrix((np.ones(len(termNode)),
+                                            (termNode, np.arange(len(termNode)))),
+                                           shape=(len(nodes), len(termNode)))
+        if not self.compact:
+            self.basal = np.array([parindex[mg.regulation[node]['basal']] for node in nodes], dtype=int)
+        if self.modeltype == 'heaviside':
+            self.sigmaH = np.array([parindex['sigmaH_' + node] for node in nodes], dtype=int)
+
+        self.indexKinetics(mg, nodes, parindex, varindex)
+
+    def regulatoryFunctions(self, Y, pars):
+        """
+        Evaluates the regulatory function of every node in the model.
+
+        :param Y: Current model state, one row per state variable
+        :type Y: ndarray
+        :param pars: Parameter values, broadcastable against Y
+        :type pars: ndarray
+        :returns:
+            - f: Array with one row per node, with values between 0 and 1
+        """
+        E = self.numEdges
+        edge = np.empty((self.constantEdge + 1,) + Y.shape[1:])
+        edge[self.speciesEdges] = Y[self.speciesSource]
+        edge[self.inputEdges] = pars[self.inputSource]
+        if self.modeltype == 'hill':
+            edge[:E] = (edge[:E]/pars[self.threshold])**pars[self.hillCoefficient]
+        if self.compact:
+            # Probability of each regulator to be ON, and OFF
+            edge[:E] = edge[:E]/(1. + edge[:E])
+            edge[E:2*E] = 1. - edge[:E]
+        edge[-1] = 1.
+        terms = edge[self.termEdges].prod(axis=1)
+        if self.compact:
+            return self.incidence @ terms
+        weighted = self.incidence @ (pars[self.termCoefficient]*terms)
+        if self.modeltype == 'hill':
+            return (pars[self.basal] + weighted)/(1. + self.incidence @ terms)
+        elif self.modeltype == 'heaviside':
+            # As in the generated expressions, the magnitude
+            # of the exponent is truncated to prevent blowup
+            exponent = -pars[self.sigmaH]*(pars[self.basal] + weighted)
+            return 1./(1. + np.exp(np.clip(exponent, -10., 10.)))
+
+    def jacobian(self, Y, t, pars):
+        """
+        Computes the Jacobian of the model analytically. Each term of a
+        regulatory function is a product of edges, so that its derivative
+        with respect to one edge is the product of the other edges of the
+        term, obtained from prefix and suffix products. These are chained
+        with the derivatives of the edges with respect to their regulators,
+        dh/dp = n/k*(p/k)^(n-1) for Hill functions.
+        The arguments are the same as those of __call__(), and the
+        function can be passed as Dfun to scipy.integrate.odeint().
+
+        :returns:
+            - J: Array of shape (d, d) if Y is a vector of length d, else (d, d, number of cells). J[i, j] is the derivative of dY[i] with respect to Y[j].
+        """
+        Y = np.asarray(Y, dtype=float)
+        pars = np.asarray(pars, dtype=float)
+        if pars.ndim == 1 and Y.ndim > 1:
+            pars = pars.reshape(pars.shape + (1,)*(Y.ndim - 1))
+        tail = Y.shape[1:]
+        E = self.numEdges
+        edge = np.empty((self.constantEdge + 1,) + tail)
+        edge[self.speciesEdges] = Y[self.speciesSource]
+        edge[self.inputEdges] = pars[self.inputSource]
+        ## Derivative of each edge with respect to its regulator
+        if self.modeltype == 'hill':
+            threshold = pars[self.threshold]
+            hillCoefficient = pars[self.hillCoefficient]
+            ratio = edge[:E]/threshold
+            dedge = hillCoefficient/threshold*ratio**(hillCoefficient - 1.)
+            edge[:E] = ratio**hillCoefficient
+            if self.compact:
+                dedge = dedge/(1. + edge[:E])**2
+                edge[:E] = edge[:E]/(1. + edge[:E])
+                edge[E:2*E] = 1. - edge[:E]
+        else:
+            dedge = np.ones((E,) + tail)
+        edge[-1] = 1.
+
+        ## Derivative of each term with respect to each of its edges
+        values = edge[self.termEdges]
+        prefix = np.ones_like(values)
+        prefix[:, 1:] = np.cumprod(values[:, :-1], axis=1)
+        suffix = np.ones_like(values)
+        suffix[:, :-1] = np.cumprod(values[:, :0:-1], axis=1)[:, ::-1]
+        terms = prefix[:, -1]*values[:, -1]
+
+        ## Derivative of each regulatory function with respect to each of its terms
+        if self.compact:
+            dterm = np.ones(terms.shape)
+        else:
+            coefficient = pars[self.termCoefficient]
+            weighted = self.incidence @ (coefficient*terms)
+            if self.modeltype == 'hill':
+                denominator = 1. + self.incidence @ terms
+                f = (pars[self.basal] + weighted)/denominator
+                dterm = (coefficient - f[self.termNode])/denominator[self.termNode]
+            elif self.modeltype == 'heaviside':
+                sigmaH = pars[self.sigmaH]
+                exponent = -sigmaH*(pars[self.basal] + weighted)
+                f = 1./(1. + np.exp(np.clip(exponent, -10., 10.)))
+                # The derivative vanishes where the exponent is truncated
+                dexponent = np.where(np.abs(exponent) < 10., f*(1. - f)*sigmaH, 0.)
+                dterm = coefficient*dexponent[self.termNode]
+        slots = (dterm[:, None]*prefix*suffix).reshape((values.shape[0]*values.shape[1], -1))
+        dfdedge = (self.slotIncidence @ slots).reshape((E,) + tail)*dedge
+
+        ## Assemble the Jacobian
+        scale = np.empty((len(self.nodeRow),) + tail)
+        scale[self.geneNodes] = pars[self.mRNATranscription]
+        if len(self.proteinNodes) > 0:
+            scale[self.proteinNodes] = pars[self.signalingTimescale]*pars[self.yMax]
+        J = np.zeros((self.numVars, self.numVars) + tail)
+        J[self.geneX, self.geneX] = -pars[self.mRNADegradation]
+        J[self.geneP, self.geneX] = pars[self.proteinTranslation]
+        J[self.geneP, self.geneP] = -pars[self.proteinDegradation]
+        if len(self.proteinNodes) > 0:
+            J[self.proteinP, self.proteinP] = -pars[self.signalingTimescale]
+        targets = self.edgeNode[self.speciesEdges]
+        np.add.at(J, (self.nodeRow[targets], self.speciesSource),
+                  scale[targets]*dfdedge[self.speciesEdges])
+        return J
+
+    def jacobianSparsity(self):
+        """
+        Returns the sparsity pattern of the Jacobian, which follows
+        the regulatory graph.
+
+        :returns:
+            - pattern: Sparse boolean matrix of shape (d, d), True where J[i, j] can be nonzero
+        """
+        targets = self.edgeNode[self.speciesEdges]
+        rows = np.concatenate([self.geneX, self.geneP, self.geneP,
+                               self.proteinP, self.nodeRow[targets]])
+        cols = np.concatenate([self.geneX, self.geneX, self.geneP,
+                               self.proteinP, self.speciesSource])
+        pattern = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                    shape=(self.numVars, self.numVars))
+        pattern.sum_duplicates()
+        return pattern
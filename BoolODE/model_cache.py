@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import uuid
+import pickle
+import hashlib
+from pathlib import Path
+# local imports
+from BoolODE.model_generator import GenerateModel
+
+class ModelCache:
+    """Content-addressed cache of the models constructed by GenerateModel.
+
+    A model only depends on the files describing the Boolean model, the
+    default kinetic parameters in parameters.yaml and a few job settings.
+    These are hashed into a key, and the model generated for a key is
+    stored in memory and in a file <key>.pkl in path, so that jobs which
+    only differ in settings such as num_cells or simulation_time reuse it.
+    The model of a job is still written to parameters.txt, and to model.py
+    if write_model is True, in the job folder.
+
+    :param path: Path to the folder in which models are stored
+    :type path: str or Path
+    """
+    # Settings used by GenerateModel
+    settings = ['modeltype',
+                'hill_form',
+                'add_dummy',
+                'max_parents',
+                'sample_pars',
+                'sample_std',
+                'identical_pars']
+    # Pickled models, shared by all caches in a process
+    models = dict()
+
+    def __init__(self, path) -> None:
+        self.path = Path(path)
+
+    def key(self, settings):
+        """
+        Returns the key of the model of a job.
+
+        :param settings: The job settings dictionary
+        :type settings: dict
+        :returns:
+            - key: Hexadecimal digest of the model inputs
+        """
+        digest = hashlib.sha256()
+        sourceDir = Path(__file__).parent
+        for path in [settings['modelpath'],
+                     settings['parameter_inputs_path'],
+                     settings['parameter_set'],
+                     settings['interaction_strengths'],
+                     settings['species_type'],
+                     sourceDir / 'parameters.yaml',
+                     # Changes to the model generator invalidate the cache
+                     sourceDir / 'model_generator.py',
+                     sourceDir / 'utils.py']:
+            path = Path(path)
+            digest.update(path.read_bytes() if path.is_file() else b'')
+            digest.update(b'\0')
+        relevant = {k:settings[k] for k in ModelCache.settings}
+        # Random numbers are only used to sample parameters
+        # and to add dummy genes
+        if settings['sample_pars'] or settings['add_dummy']:
+            relevant['seed'] = settings['seed']
+        digest.update(json.dumps(relevant, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, settings, parameterInputsDF, parameterSetDF, interactionStrengthDF):
+        """
+        Returns the model of a job. The model is only generated if
+        it is not found in the cache. The arguments are those of GenerateModel.
+
+        :returns:
+            - mg: GenerateModel
+        """
+        key = self.key(settings)
+        cachePath = self.path / (key + '.pkl')
+        data = ModelCache.models.get(key)
+        if data is None and cachePath.is_file():
+            data = cachePath.read_bytes()
+            ModelCache.models[key] = data
+        if data is None:
+            mg = GenerateModel(settings,
+                               parameterInputsDF,
+                               parameterSetDF,
+                               interactionStrengthDF)
+            data = pickle.dumps(mg)
+            ModelCache.models[key] = data
+            # Write to a temporary file first, as
+            # concurrent jobs might write the same model
+            self.path.mkdir(parents=True, exist_ok=True)
+            tempPath = self.path / (key + '.' + uuid.uuid4().hex + '.tmp')
+            tempPath.write_bytes(data)
+            os.replace(tempPath, cachePath)
+            return mg
+        print('Using cached model', key[:12])
+        # Every job gets its own copy of the model
+        mg = pickle.loads(data)
+        mg.settings = settings
+        if settings['write_model']:
+            mg.writeModelToFile()
+        mg.writeParametersToFile()
+        return mg
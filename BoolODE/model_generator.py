@@ -20,7 +20,8 @@ from typing import Dict, List
 # local imports
 from BoolODE import utils
 from BoolODE import simulator 
-from importlib.machinery import SourceFileLoader
+from BoolODE.source_model import SourceModel
+from BoolODE.compiled_model import CompiledModel
 
 class GenerateModel:
     """Class that holds model attributes. Provides helper functions to convert a Boolean model
@@ -65,7 +66,10 @@ class GenerateModel:
         self.nodeTypeDF = pd.DataFrame()
         self.df = pd.DataFrame()
         self.ModelSpec = dict()
+        self.regulation = dict()
         self.path_to_ode_model = str()
+        # Random numbers used to sample parameters
+        self.rng = utils.getGenerator(settings['seed'], utils.PARAMETER_STREAM)
         # Read the model definition
         # 1. populate self.df
         # 2. store genelist, withRules, withoutRules, allnodes
@@ -76,7 +80,8 @@ class GenerateModel:
         # Create the model dictionary
         self.generateModelDict()
         # Write ODE model to file
-        self.writeModelToFile()
+        if self.settings['write_model']:
+            self.writeModelToFile()
         # Write parameters to file
         self.writeParametersToFile()
         
@@ -107,7 +112,7 @@ class GenerateModel:
             reg = [t for t in tokens if t not in ['not','and','or','']]
             self.allnodes.update(set(reg))
     
-        self.withoutRules = list(self.allnodes.difference(set(self.withRules)))
+        self.withoutRules = sorted(self.allnodes.difference(set(self.withRules)))
 
         ## Every node without a rule is treated as follows:
         ## If the user has specified a Parameter Input file treat as parameter, else 
@@ -189,7 +194,7 @@ class GenerateModel:
             #                ignore_index = True)
             self.df = self.df.append({'Gene':'dummy' + str(dg),
                                       'Rule':' or '.join([s for s in \
-                                                          np.random.choice(list(allnodes),
+                                                          self.rng.choice(list(allnodes),
                                                                            size=max_parents)])},
                                      ignore_index = True)
         self.df.to_csv(self.setting['outPrefix'] + 'rules-with-added-genes.csv')        
@@ -263,6 +268,9 @@ class GenerateModel:
         ## Create a parameter of each parameter type for each gene.
         ## If samplePars=True, sample values from normal distributions,
         ## else, set all parameters to defaults
+        # Kinetic parameters which can be sampled
+        self.sampledParameterPrefixes = dict(parameterNamePrefixAndDefaultsAll,
+                                             **parameterNamePrefixAndDefaultsGenes)
         if self.settings['sample_pars']:
             self.assignSampledParameterValues(parameterNamePrefixAndDefaultsAll,
                                      parameterNamePrefixAndDefaultsGenes)
@@ -365,35 +373,88 @@ class GenerateModel:
         """ 
         Sample kinetic parameters from a truncated normal distribution with mean=default
         parameter value, and standard deviation = sample_std, in a range +- 10% of 
-        the default value. 
+        the default value, see sampleKineticParameters().
         """
         print("Sampling parameter values")
         print("Using std=" + str(self.settings['sample_std']))
+        names, values = self.sampleKineticParameters(1, self.rng)
+        for name, value in zip(names, values[0]):
+            self.par[name] = float(value)
+
+    def getSampledParameterDefaults(self):
+        """
+        Returns the kinetic parameters which are sampled if sample_pars is True.
+
+        :returns:
+            - defaults: Mapper: {parameter prefix : {parameter name : default value}}
+        """
+        defaults = {}
+        for parPrefix, parDefault in self.sampledParameterPrefixes.items():
+            defaults[parPrefix] = {parPrefix + node:parDefault for node in self.withRules\
+                                   if node in self.genelist}
+        return defaults
+
+    def sampleKineticParameters(self, numSets, rng=None):
+        """
+        Samples independent sets of kinetic parameters at once. Each
+        parameter is drawn from a truncated normal distribution with
+        mean=default parameter value, and standard deviation = sample_std*default,
+        in a range +- 10% of the default value (see utils.truncatedNormal()).
+        If identical_pars is True, all parameters with the same prefix
+        take the same value within a set.
+
+        :param numSets: Number of parameter sets
+        :type numSets: int
+        :param rng: Random number generator. If None, the parameter stream of the job is used.
+        :type rng: numpy.random.Generator
+        :returns:
+            - names: Names of the sampled parameters
+            - values: Array of shape (numSets, number of sampled parameters)
+        """
+        if rng is None:
+            rng = self.rng
         lomult = 0.9
         himult = 1.1
+        names, defaults, prefixIndex = [], [], []
+        prefixDefaults = []
+        for pi, (parPrefix, parameters) in enumerate(self.getSampledParameterDefaults().items()):
+            prefixDefaults.append(self.sampledParameterPrefixes[parPrefix])
+            for name, parDefault in parameters.items():
+                names.append(name)
+                defaults.append(parDefault)
+                prefixIndex.append(pi)
+        if self.settings['identical_pars']:
+            # One value per prefix, shared by all its parameters
+            mu = np.array(prefixDefaults)
+            values = utils.truncatedNormal((numSets, len(mu)), lomult*mu, himult*mu,
+                                           mu, self.settings['sample_std']*mu, rng)
+            values = values[:, np.array(prefixIndex, dtype=int)]
+        else:
+            mu = np.array(defaults)
+            values = utils.truncatedNormal((numSets, len(mu)), lomult*mu, himult*mu,
+                                           mu, self.settings['sample_std']*mu, rng)
+        return names, values
 
-        for parPrefix, parDefault in parameterNamePrefixAndDefaultsAll.items():
-            sampledParameterValues = utils.getSaneNval(len(self.withRules),\
-                                                 lo=lomult*parDefault,\
-                                                 hi=himult*parDefault,\
-                                                 mu=parDefault,\
-                                                 sig=self.settings['sample_std']*parDefault,\
-                                                 identicalPars=self.settings['identical_pars'])
-            for node, sparval in zip(self.withRules, sampledParameterValues):
-                if node in self.genelist:
-                    self.par[parPrefix + node] = sparval
-                    
-        for parPrefix, parDefault in parameterNamePrefixAndDefaultsGenes.items():
-            sampledParameterValues = utils.getSaneNval(len(self.withRules),\
-                                                 lo=lomult*parDefault,\
-                                                 hi=himult*parDefault,\
-                                                 mu=parDefault,\
-                                                 sig=self.settings['sample_std']*parDefault,\
-                                                 identicalPars=self.settings['identical_pars'])
-            
-            for node, sparval in zip(self.withRules, sampledParameterValues):
-                if node in self.genelist:
-                    self.par[parPrefix + node] = sparval
+    def sampleParameterSets(self, numSets, rng=None):
+        """
+        Returns independent parameter sets of the model, in which the kinetic
+        parameters are sampled as described in sampleKineticParameters(),
+        and all other parameters take their values in the model.
+
+        :param numSets: Number of parameter sets
+        :type numSets: int
+        :param rng: Random number generator. If None, the parameter stream of the job is used.
+        :type rng: numpy.random.Generator
+        :returns:
+            - pars: Array of shape (numSets, number of parameters), with parameters sorted by name, as passed to Model()
+        """
+        parNames = sorted(self.ModelSpec['pars'].keys())
+        parindex = {p:i for i, p in enumerate(parNames)}
+        pars = np.tile(np.array([self.ModelSpec['pars'][p] for p in parNames], dtype=float),
+                       (numSets, 1))
+        names, values = self.sampleKineticParameters(numSets, rng)
+        pars[:, [parindex[name] for name in names]] = values
+        return pars
 
     def createRegulatoryTerms(self, currgene, combinationOfRegulators,
                               regSpecies):
@@ -410,21 +471,11 @@ class GenerateModel:
         :param combinationOfRegulators: a list of all combinations of regulators of currgene
         :type combinationOfRegulators: list
         """
-        strengthSpecified = False
-        if not self.interactionStrengthDF.empty:
-            if currgene in self.interactionStrengthDF['Gene1'].values:
-                strengthSpecified = True
-                regulatorsWithStrength = set(self.interactionStrengthDF[\
-                                                                        self.interactionStrengthDF['Gene1']\
-                                                                        == currgene]['Gene2'].values)            
         if self.settings['modeltype'] == 'hill':
             # Create the hill function terms for each regulator
             hills = []
             for reg in combinationOfRegulators:
-                if strengthSpecified and (reg in regulatorsWithStrength):
-                    hillThresholdName = 'k_' + reg+ '_' + currgene
-                else:
-                    hillThresholdName = 'k_' + reg
+                hillThresholdName = self.getHillThresholdName(currgene, reg)
 
                 if reg in regSpecies:
                     hills.append('(p_'+ reg +'/'+hillThresholdName+')^n_'+ reg)
@@ -440,16 +491,74 @@ class GenerateModel:
             mult = '*'.join(terms)
             return mult        
                     
+    def createCompactHillFunction(self, currgene, rule, allreg, regSpecies, table):
+        """Creates the regulatory function of currgene in the compact form of
+        the Hill model. Dividing the numerator and the denominator of the
+        Hill model by the product of (1 + h_r) over all regulators r, where
+        h_r is the Hill function of r, yields the probability that the Boolean
+        rule is true if each regulator is independently ON with probability
+        h_r/(1 + h_r). This expression is factored following the structure of
+        the rule (see utils.ruleProbability()), and requires neither the alpha
+        and a parameters, nor a term for every combination of regulators.
+
+        :param currgene: Name of the current gene
+        :type currgene: str
+        :param rule: Boolean rule of currgene
+        :type rule: str
+        :param allreg: List of regulators of currgene, in the order of the truth table
+        :type allreg: list
+        :param regSpecies: Regulators that are model variables
+        :type regSpecies: set
+        :param table: Truth table of the rule, see utils.truthTable()
+        :type table: ndarray
+        :returns:
+            - f: Expression of the regulatory function
+        """
+        probabilities = {}
+        for reg in allreg:
+            hill = self.createRegulatoryTerms(currgene, [reg], regSpecies)
+            probabilities[reg] = '(' + hill + '/(1+' + hill + '))'
+        # The CompiledModel sums over disjoint sets of
+        # regulator states for which the rule is true
+        self.regulation[currgene] = {'basal':None,
+                                     'rule':rule,
+                                     'regulators':list(allreg),
+                                     'species':regSpecies,
+                                     'terms':[],
+                                     'cubes':[[(allreg[j], state) for j, state in cube]\
+                                              for cube in utils.disjointCover(table, len(allreg))]}
+        return '(' + utils.ruleProbability(rule, probabilities) + ')'
+
+    def getHillThresholdName(self, currgene, reg):
+        """Returns the name of the Hill threshold parameter of the
+        interaction reg -> currgene. If the user has specified the strength
+        of this interaction, the threshold is specific to the interaction,
+        else the default threshold of reg is used.
+
+        :param currgene: Name of the regulated gene
+        :type currgene: str
+        :param reg: Name of the regulator
+        :type reg: str
+        :returns:
+            - hillThresholdName: Name of the threshold parameter
+        """
+        if not self.interactionStrengthDF.empty:
+            regulatorsWithStrength = set(self.interactionStrengthDF[\
+                                                                    self.interactionStrengthDF['Gene1']\
+                                                                    == currgene]['Gene2'].values)
+            if reg in regulatorsWithStrength:
+                return 'k_' + reg + '_' + currgene
+        return 'k_' + reg
+
     def generateModelDict(self):
         """
         Take a DataFrame object with Boolean rules,
         construct ODE equations for each variable.
         This is the core function in BoolODE.
-        In a nutshell, a temporary namespace called boolodespace
-        is created. In this namespace, the nodes  in the Boolean network
-        are first initialized to 0, or OFF. Then, for each gene/node,
-        its corresponding rule is evaluated by setting its regulators to
-        all combinations binary states. The outcome of each of these Boolean
+        In a nutshell, the Boolean rule of each gene/node is parsed once,
+        and evaluated for all combinations of binary states of its
+        regulators at once, with all other nodes OFF (see utils.truthTable()).
+        The outcome of each of these Boolean
         rule evaluations is used to decide the value of the activation strength
         parameter 'a' in Hill functions, or the interaction parameter 'w' in 
         the Heaviside functions. 
@@ -459,93 +568,104 @@ class GenerateModel:
         ##########################################################
         ## Assign values to alpha parameters representing the logic
         ## relationships between variables
-        # Initialize new namespace
-        boolodespace = {}
-
-        # Initialize empty equations
-        for node in self.withRules:
-            # Initialize species to 0
-            tempStr = node + " = 0"  
-            exec(tempStr, boolodespace)
-
         # If there is no rule correspondng to a node, it is either
         # a user specified parameter input, or it is assigned a self loop.
         if not self.parameterInputsDF.empty:
             self.inputs = set(self.withoutRules)
-            for k in self.parameterInputsDF['Input']:
-                # Initialize variables to 0
-                tempStr = k + " = 0"  
-                exec(tempStr, boolodespace)
 
+        # The compact form of Hill functions avoids
+        # enumerating all combinations of regulators
+        compact = self.settings['modeltype'] == 'hill'\
+            and self.settings['hill_form'] == 'compact'
+
+        truthTables = {}
         for i,row in self.df.iterrows():
+            ## Parse Boolean rule to get list of regulators
+            allreg, regSpecies, regInputs = utils.getRegulatorsInRule(row['Rule'],
+                                                                      self.withRules,
+                                                                      self.inputs)
+            # Sorted, so that the model does not depend on the order of the set
+            regulators = sorted(allreg)
+            # Evaluate the rule for every combination of regulator states,
+            # and keep the regulators for the construction of the expressions
+            table = utils.truthTable(row['Rule'], regulators)
+            truthTables[row['Gene']] = (regulators, regSpecies, regInputs, table)
             # Basal expression:
-            # Execute the rule to figure out
-            # the value of alpha_0 or omega_0
-            exec('booleval = ' + row['Rule'], boolodespace)         
-            if self.settings['modeltype'] == 'hill':
-                self.par['alpha_'+row['Gene']] = int(boolodespace['booleval'])
+            # The value of the rule when all nodes are OFF
+            # decides the value of alpha_0 or omega_0
+            booleval = table[0]
+            if self.settings['modeltype'] == 'hill' and not compact:
+                self.par['alpha_'+row['Gene']] = int(booleval)
             elif self.settings['modeltype'] == 'heaviside':
-                self.par['omega_' + row['Gene']] = utils.heavisideThreshold(boolodespace['booleval'])
+                self.par['omega_' + row['Gene']] = utils.heavisideThreshold(booleval)
         # End initialization
 
         # Assign values to logic parameters, and construct expressions
         for i,row in self.df.iterrows():
-            ## Parse Boolean rule to get list of regulators
-            allreg, regSpecies, regInputs = utils.getRegulatorsInRule(row['Rule'],
-                                                                      self.withRules,
-                                                                      self.inputs)
+            ## Regulators and truth table of the rule, see above
+            allreg, regSpecies, regInputs, table = truthTables[row['Gene']]
+            # Bit of each regulator in the index of the truth table
+            position = {reg:j for j, reg in enumerate(allreg)}
 
-            # Basal expression term
             currgene = row['Gene']
-            if self.settings['modeltype'] == 'hill':
-                num = '( alpha_' + currgene
-                den = '( 1'
-            elif self.settings['modeltype'] == 'heaviside':
-               exponent = '- sigmaH_' + currgene +'*( omega_' + currgene
-
-            # Loop over combinations of regulators        
-            for i in range(1,len(allreg) + 1):
-                for combinationOfRegulators in combinations(allreg,i):
-                    regulatorExpression = self.createRegulatoryTerms(currgene, combinationOfRegulators,
-                                                                      regSpecies)
-                    if self.settings['modeltype'] == 'hill':
-                        # Create Numerator and Denominator
-                        den += ' +' +  regulatorExpression
-                        num += ' + a_' + currgene +'_'  + '_'.join(list(combinationOfRegulators)) + '*' + regulatorExpression
-                    elif self.settings['modeltype'] == 'heaviside':
-                        exponent += ' + w_' + currgene + '_' + '_'.join(list(combinationOfRegulators)) +'*' + regulatorExpression
+            if compact:
+                f = self.createCompactHillFunction(currgene, row['Rule'], allreg,
+                                                   regSpecies, table)
+            else:
+                # Basal expression term
+                if self.settings['modeltype'] == 'hill':
+                    num = '( alpha_' + currgene
+                    den = '( 1'
+                    basal = 'alpha_' + currgene
+                elif self.settings['modeltype'] == 'heaviside':
+                   exponent = '- sigmaH_' + currgene +'*( omega_' + currgene
+                   basal = 'omega_' + currgene
+                # Keep track of the structure of the regulatory function,
+                # used to build the CompiledModel and the SparseModel
+                self.regulation[currgene] = {'basal':basal,
+                                             'rule':row['Rule'],
+                                             'regulators':list(allreg),
+                                             'species':regSpecies,
+                                             'terms':[]}
+
+                # Loop over combinations of regulators        
+                for i in range(1,len(allreg) + 1):
+                    for combinationOfRegulators in combinations(allreg,i):
+                        regulatorExpression = self.createRegulatoryTerms(currgene, combinationOfRegulators,
+                                                                          regSpecies)
+                        if self.settings['modeltype'] == 'hill':
+                            # Create Numerator and Denominator
+                            den += ' +' +  regulatorExpression
+                            num += ' + a_' + currgene +'_'  + '_'.join(list(combinationOfRegulators)) + '*' + regulatorExpression
+                            coefficient = 'a_' + currgene +'_'  + '_'.join(list(combinationOfRegulators))
+                        elif self.settings['modeltype'] == 'heaviside':
+                            exponent += ' + w_' + currgene + '_' + '_'.join(list(combinationOfRegulators)) +'*' + regulatorExpression
+                            coefficient = 'w_' + currgene + '_' + '_'.join(list(combinationOfRegulators))
+                        self.regulation[currgene]['terms'].append((coefficient, combinationOfRegulators))
     
-                    # evaluate rule to assign values to parameters
-                    ##################################################
-                    for node in self.withRules:                 #
-                        exec(node + ' = 0', boolodespace)  #                        
-                    # Set each regulator to ON, evaluate rule. we are looping
-                    # over all such combinations of regulators
-                    for geneInList in combinationOfRegulators:     #
-                        exec(geneInList + ' = 1', boolodespace)    #
-                                                                   #
-                    exec('boolval = ' + row['Rule'], boolodespace) #
-                    ##################################################
+                        # Look up the value of the rule when only
+                        # this combination of regulators is ON
+                        boolval = table[sum([1 << position[reg] for reg in combinationOfRegulators])]
     
-                    if self.settings['modeltype'] == 'hill':
-                        self.par['a_' + currgene +'_'  + '_'.join(list(combinationOfRegulators))] = \
-                            int(boolodespace['boolval'])
-                    elif self.settings['modeltype'] == 'heaviside':
-                        self.par['w_' + currgene +'_'  + '_'.join(list(combinationOfRegulators))] = \
-                            self.kineticParameterDefaults['heavisideOmega']*utils.heavisideThreshold(boolodespace['boolval'])                    
-
-            # Close expressions
-            if self.settings['modeltype'] == 'hill':
-                num += ' )'
-                den += ' )'
-                f = '(' + num + '/' + den + ')'
-            elif self.settings['modeltype'] == 'heaviside':
-                # In the case of heaviside expressions, to prevent
-                # numerical blowup, we trucate the magnitude of the
-                # regulatory terms
-                exponent += ')'
-                maxexp = '10.' # '100'
-                f = '(1./(1. + np.exp(np.sign('+exponent+')*min(' +maxexp +',abs(' + exponent+ ')))))'
+                        if self.settings['modeltype'] == 'hill':
+                            self.par['a_' + currgene +'_'  + '_'.join(list(combinationOfRegulators))] = \
+                                int(boolval)
+                        elif self.settings['modeltype'] == 'heaviside':
+                            self.par['w_' + currgene +'_'  + '_'.join(list(combinationOfRegulators))] = \
+                                self.kineticParameterDefaults['heavisideOmega']*utils.heavisideThreshold(boolval)                    
+
+                # Close expressions
+                if self.settings['modeltype'] == 'hill':
+                    num += ' )'
+                    den += ' )'
+                    f = '(' + num + '/' + den + ')'
+                elif self.settings['modeltype'] == 'heaviside':
+                    # In the case of heaviside expressions, to prevent
+                    # numerical blowup, we trucate the magnitude of the
+                    # regulatory terms
+                    exponent += ')'
+                    maxexp = '10.' # '100'
+                    f = '(1./(1. + np.exp(np.sign('+exponent+')*np.minimum(' +maxexp +',abs(' + exponent+ ')))))'
             
             if currgene in self.proteinlist:
                 Production =  f
@@ -581,9 +701,31 @@ class GenerateModel:
         self.varmapper = {i:var for i,var in enumerate(self.ModelSpec['varspecs'].keys())}
         self.parmapper = {i:par for i,par in enumerate(self.ModelSpec['pars'].keys())}
 
-    def writeModelToFile(self):
+    def getDegradationParameters(self):
+        """
+        Returns the parameter of the linear degradation term of each
+        variable, in the order of the variables in the model state.
+        mRNA x_g is degraded with rate l_x_g, the protein p_g of a gene
+        with rate l_p_g, and signaling proteins with rate signalingtimescale.
+
+        :returns:
+            - names: List of parameter names, one per variable
         """
-        Writes model to file as a python function.
+        names = []
+        for i in range(len(self.varmapper.keys())):
+            var = self.varmapper[i]
+            node = var[2:]
+            if var.startswith('x_'):
+                names.append('l_x_' + node)
+            elif node in self.proteinlist:
+                names.append('signalingtimescale')
+            else:
+                names.append('l_p_' + node)
+        return names
+
+    def getModelSource(self):
+        """
+        Returns the source code of the model as a python function.
         The ODE model generated using generateModelDict() is defined as 
         a python ODE function called Model(). Model() takes 3 arguments:
 
@@ -592,32 +734,66 @@ class GenerateModel:
         3. A list of parameters pars
 
         The function returns a vector of time derivatives computed from the ODEs.
+        Y can also hold the states of a batch of cells, with one row per
+        state variable and one column per cell, in which case one column of
+        time derivatives is returned per cell.
+
+        :returns:
+            - source: Source code defining Model()
+        """
+        lines = []
+        lines.append('#####################################################\n')
+        lines.append('import numpy as np\n')
+        lines.append('# This file is created automatically\n')
+        lines.append('def Model(Y,t,pars):\n')
+        lines.append('    # Parameters\n')
+        par_names = sorted(self.ModelSpec['pars'].keys())
+        for i,p in enumerate(par_names):
+            lines.append('    ' + p + ' = pars[' + str(i) + ']\n')
+        outstr = ''
+        lines.append('    # Variables\n')
+        for i in range(len(self.varmapper.keys())):
+            lines.append('    ' + self.varmapper[i] + ' = Y[' + str(i) + ']\n')
+            outstr += 'd' + self.varmapper[i] + ','
+        for i in range(len(self.varmapper.keys())):
+            vdef = self.ModelSpec['varspecs'][self.varmapper[i]]
+            vdef = vdef.replace('^','**')
+            lines.append('    d' + self.varmapper[i] + ' = '+vdef+'\n')
+
+        lines.append('    dY = np.array([' + outstr+ '])\n')
+        lines.append('    return(dY)\n')
+        lines.append('#####################################################')
+        return ''.join(lines)
+
+    def getModel(self):
+        """
+        Compiles the model in memory, without writing it to a file.
+
+        :returns:
+            - Model: SourceModel, called like the Model() function in model.py
+        """
+        return SourceModel(self.getModelSource())
+
+    def getJacobian(self):
+        """
+        Returns a function computing the Jacobian of the model analytically,
+        from the structure of the regulatory functions built in generateModelDict().
+        It is called like Model(), see CompiledModel.jacobian().
+
+        :returns:
+            - jacobian: function
+        """
+        return CompiledModel(self).jacobian
+
+    def writeModelToFile(self):
+        """
+        Writes model to file as a python function, see getModelSource().
         Model() is written model.py in the directory of the current job
         """
         self.path_to_ode_model = self.settings['outprefix'] / 'model.py'
 
         with open(self.path_to_ode_model,'w') as out:
-            out.write('#####################################################\n')
-            out.write('import numpy as np\n')
-            out.write('# This file is created automatically\n')
-            out.write('def Model(Y,t,pars):\n')
-            out.write('    # Parameters\n')
-            par_names = sorted(self.ModelSpec['pars'].keys())
-            for i,p in enumerate(par_names):
-                out.write('    ' + p + ' = pars[' + str(i) + ']\n')
-            outstr = ''
-            out.write('    # Variables\n')
-            for i in range(len(self.varmapper.keys())):
-                out.write('    ' + self.varmapper[i] + ' = Y[' + str(i) + ']\n')
-                outstr += 'd' + self.varmapper[i] + ','
-            for i in range(len(self.varmapper.keys())):
-                vdef = self.ModelSpec['varspecs'][self.varmapper[i]]
-                vdef = vdef.replace('^','**')
-                out.write('    d' + self.varmapper[i] + ' = '+vdef+'\n')
-
-            out.write('    dY = np.array([' + outstr+ '])\n')
-            out.write('    return(dY)\n')
-            out.write('#####################################################')
+            out.write(self.getModelSource())
 
     
     def writeParametersToFile(self):
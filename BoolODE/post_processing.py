@@ -6,11 +6,16 @@ from pathlib import Path
 from sklearn.cluster import KMeans
 from sklearn.manifold import TSNE
 import matplotlib.pyplot as plt
+# local imports
+from BoolODE import utils
+from BoolODE.trajectory_store import TrajectoryStore
 
 def genSamples(opts):
     """
     Generate samples of cells from a given set of simulations. This sample
     will then be used for other post processing steps. 
+    Simulations are read from the trajectory store of the job if it
+    exists, else from the individual csv files.
     """
     numclusters = opts['nClusters']
     num_simulations = opts['num_cells']
@@ -23,8 +28,14 @@ def genSamples(opts):
         print('sample_size should be less than num of experiments')
         sample_size = num_simulations
         
-    df = pd.read_csv(opts['outPrefix'] + '/simulations/E0.csv',index_col=0)
-    maxtime = len(df.columns)
+    store = TrajectoryStore(opts['outPrefix'] + '/simulations')
+    if store.exists():
+        store.open()
+        maxtime = len(store.metadata['timepoints'])
+    else:
+        store = None
+        df = pd.read_csv(opts['outPrefix'] + '/simulations/E0.csv',index_col=0)
+        maxtime = len(df.columns)
 
     generatedPaths = []
     for did in range(1, opts['nDatasets'] + 1):
@@ -36,22 +47,27 @@ def genSamples(opts):
         if not os.path.exists(outfpath):
             print(outfpath, "does not exist, creating it...")
             os.makedirs(outfpath)
+        # Every dataset is sampled from its own stream of random numbers
+        rng = utils.getGenerator(opts['seed'], utils.GENSAMPLES_STREAM, did)
         # Create cell ids
-        simids = np.random.choice(range(num_simulations), size=sample_size, replace=False)
+        simids = rng.choice(range(num_simulations), size=sample_size, replace=False)
         fids = ['E'+ str(sid) + '.csv' for sid in simids]            
-        timepoints = np.random.choice(range(1,maxtime), size=sample_size)
+        timepoints = rng.choice(range(1,maxtime), size=sample_size)
         min_t = min(timepoints)
         max_t = max(timepoints)
         pts = [(t - min_t)/(max_t - min_t) for t in timepoints]
         cellids = ['E' + str(sid) + '_' + str(t) for sid, t in zip(simids, timepoints)] 
         # Read simulations from input dataset #psetid
         # to build a sample
-        sample = []
-        for fid, cid in tqdm(zip(fids, cellids)):
-            df = pd.read_csv( opts['outPrefix'] + '/simulations/' + fid, index_col=0)
-            df.sort_index(inplace=True)
-            sample.append(df[cid].to_frame())
-        sampledf = pd.concat(sample,axis=1)
+        if store is not None:
+            sampledf = store.sample(list(simids), list(timepoints))
+        else:
+            sample = []
+            for fid, cid in tqdm(zip(fids, cellids)):
+                df = pd.read_csv( opts['outPrefix'] + '/simulations/' + fid, index_col=0)
+                df.sort_index(inplace=True)
+                sample.append(df[cid].to_frame())
+            sampledf = pd.concat(sample,axis=1)
         sampledf.to_csv(outfpath + '/ExpressionData.csv')
         ## Read refNetwork.csv
         refdf = pd.read_csv(opts['outPrefix'] + '/refNetwork.csv')
@@ -102,12 +118,13 @@ def genDropouts(opts):
     
     # Drop-out genes if they are less than the 
     # percentile value @ "dc" with 50% chance
+    rng = utils.getGenerator(opts['seed'], utils.DROPOUT_STREAM, *opts['stream'])
     if dropoutCutoffs != 0:
         quantileExp = expDF.quantile(q = dropoutCutoffs, axis = 'columns')
         for idx, row in tqdm(expDF.iterrows()):
             for col in expDF.columns:
                 if row[col] < quantileExp.loc[idx]:
-                    cointoss = np.random.random()
+                    cointoss = rng.random()
                     if cointoss < opts['drop_prob']:
                         DropOutDF.loc[idx,col] = 0.0
 
@@ -5,6 +5,8 @@ import os
 import sys
 import ast
 import time
+import uuid
+import pickle
 import warnings
 import numpy as np
 import pandas as pd
@@ -14,21 +16,72 @@ from optparse import OptionParser
 from itertools import combinations
 from scipy.integrate import odeint
 from sklearn.cluster import KMeans
-from importlib.machinery import SourceFileLoader
+from concurrent.futures import ThreadPoolExecutor
 import multiprocessing as mp
 # local imports
 from BoolODE import utils
 from BoolODE.model_generator import GenerateModel
-from BoolODE import simulator 
+from BoolODE.model_cache import ModelCache
+from BoolODE.compiled_model import CompiledModel
+from BoolODE.sparse_model import SparseModel
+from BoolODE.trajectory_store import TrajectoryStore
+from BoolODE import simulator
+from BoolODE import attractors
 
 np.seterr(all='raise')
 
+def getInitialGuess(mg, icsDF):
+    """
+    Computes the values of the state variables from which the
+    initial condition of every simulation is derived, see
+    simulator.getInitialCondition(). These are the user defined
+    initial conditions if specified.
+
+    :param mg: Model details obtained by instantiating an object of GenerateModel
+    :type mg: BoolODE.GenerateModel
+    :param icsDF: Dataframe specifying initial condition for simulation
+    :type icsDF: pandas DataFrame
+    :returns:
+        - ss: Array of the values of the state variables
+    """
+    revvarmapper = {v:k for k,v in mg.varmapper.items()}
+    ss = np.zeros(len(mg.varmapper.keys()))
+    
+    for i,k in mg.varmapper.items():
+        if 'x_' in k:
+            ss[i] = 1.0
+        elif 'p_' in k:
+            if k.replace('p_','') in mg.proteinlist:
+                # Seting them to the threshold
+                # causes them to drop to 0 rapidly
+                # TODO: try setting to threshold < v < y_max
+                ss[i] = 20.
+            
+    if not icsDF.empty:
+        icsspec = icsDF.loc[0]
+        genes = ast.literal_eval(icsspec['Genes'])
+        values = ast.literal_eval(icsspec['Values'])
+        icsmap = {g:v for g,v in zip(genes,values)}
+        for i,k in mg.varmapper.items():
+            for p in mg.proteinlist:
+                if p in icsmap.keys():
+                    ss[revvarmapper['p_'+p]] = icsmap[p]
+                else:
+                    ss[revvarmapper['p_'+p]] = 0.01
+            for g in mg.genelist:
+                if g in icsmap.keys():
+                    ss[revvarmapper['x_'+g]] = icsmap[g]
+                else:
+                    ss[revvarmapper['x_'+g]] = 0.01
+    return ss
+
 def Experiment(mg, Model,
                tspan,
                settings,
                icsDF,
                writeProtein=False,
-               normalizeTrajectory=False):
+               normalizeTrajectory=False,
+               pool=None):
     """
     Carry out an `in-silico` experiment. This function takes as input 
     an ODE model defined as a python function and carries out stochastic
@@ -54,46 +107,30 @@ def Experiment(mg, Model,
     :type writeProtein: bool
     :param normalizeTrajectory: Bool specifying if the gene expression values should be scaled between 0 and 1.
     :type normalizeTrajectory: bool 
+    :param pool: Worker pool used if do_parallel is True, see createPool(). If None, a pool is created for this experiment.
+    :type pool: multiprocessing.pool.Pool
     """
     ####################    
     allParameters = dict(mg.ModelSpec['pars'])
     parNames = sorted(list(allParameters.keys()))
     ## Use default parameters 
-    pars = [mg.ModelSpec['pars'][k] for k in parNames]
+    pars = np.array([mg.ModelSpec['pars'][k] for k in parNames], dtype=float)
+    if settings['sample_cell_pars']:
+        ## Every cell gets its own set of kinetic parameters,
+        ## one row per cell
+        cellPars = mg.sampleParameterSets(settings['num_cells'],
+                                          rng=utils.getGenerator(settings['seed'],
+                                                                 utils.PARAMETER_STREAM, 1))
+        np.save(Path(settings['outprefix'], 'cell_parameters.npy'), cellPars)
+    else:
+        cellPars = None
     ####################
     rnaIndex = [i for i in range(len(mg.varmapper.keys())) if 'x_' in mg.varmapper[i]]
     revvarmapper = {v:k for k,v in mg.varmapper.items()}
     proteinIndex = [i for i in range(len(mg.varmapper.keys())) if 'p_' in mg.varmapper[i]]
 
     y0 = [mg.ModelSpec['ics'][mg.varmapper[i]] for i in range(len(mg.varmapper.keys()))]
-    ss = np.zeros(len(mg.varmapper.keys()))
-    
-    for i,k in mg.varmapper.items():
-        if 'x_' in k:
-            ss[i] = 1.0
-        elif 'p_' in k:
-            if k.replace('p_','') in mg.proteinlist:
-                # Seting them to the threshold
-                # causes them to drop to 0 rapidly
-                # TODO: try setting to threshold < v < y_max
-                ss[i] = 20.
-            
-    if not icsDF.empty:
-        icsspec = icsDF.loc[0]
-        genes = ast.literal_eval(icsspec['Genes'])
-        values = ast.literal_eval(icsspec['Values'])
-        icsmap = {g:v for g,v in zip(genes,values)}
-        for i,k in mg.varmapper.items():
-            for p in mg.proteinlist:
-                if p in icsmap.keys():
-                    ss[revvarmapper['p_'+p]] = icsmap[p]
-                else:
-                    ss[revvarmapper['p_'+p]] = 0.01
-            for g in mg.genelist:
-                if g in icsmap.keys():
-                    ss[revvarmapper['x_'+g]] = icsmap[g]
-                else:
-                    ss[revvarmapper['x_'+g]] = 0.01
+    ss = getInitialGuess(mg, icsDF)
             
     if len(mg.proteinlist) == 0:
         result = pd.DataFrame(index=pd.Index([mg.varmapper[i] for i in rnaIndex]))
@@ -102,15 +139,15 @@ def Experiment(mg, Model,
         speciesoi.extend([revvarmapper['x_' + g] for g in mg.genelist])
         result = pd.DataFrame(index=pd.Index([mg.varmapper[i] for i in speciesoi]))
         
-    # Index of every possible time point. Sample from this list
+    # Index of every recorded time point. Sample from this list
     startat = 0
-    timeIndex = [i for i in range(startat, len(tspan))]        
+    numTimepoints = len(range(0, len(tspan), settings['record_every']))
+    timeIndex = [i for i in range(startat, numTimepoints)]        
 
     ## Construct dictionary of arguments to be passed
     ## to simulateAndSample(), done in parallel
     outPrefix = str(settings['outprefix'])
     argdict = {}
-    argdict['mg'] = mg
     argdict['allParameters'] = allParameters
     argdict['parNames'] = parNames
     argdict['Model'] = Model
@@ -123,17 +160,57 @@ def Experiment(mg, Model,
     argdict['outPrefix'] = outPrefix
     argdict['sampleCells'] = settings['sample_cells'] # TODO consider removing this option
     argdict['pars'] = pars
+    argdict['cellPars'] = cellPars
     argdict['ss'] = ss
     argdict['ModelSpec'] = mg.ModelSpec
     argdict['rnaIndex'] = rnaIndex
     argdict['proteinIndex'] = proteinIndex
     argdict['revvarmapper'] = revvarmapper
     argdict['x_max'] = mg.kineticParameterDefaults['x_max']
+    argdict['boundary'] = settings['boundary']
+    argdict['chunk_size'] = settings['noise_chunk_size']
+    argdict['record_every'] = settings['record_every']
+    argdict['seed'] = settings['seed']
+    argdict['integrator'] = settings['integrator']
+    argdict['rtol'] = settings['rtol']
+    argdict['atol'] = settings['atol']
+    argdict['milstein'] = settings['milstein']
+    argdict['isStochastic'] = not settings['deterministic']
+    if settings['deterministic']:
+        if settings['analytic_jacobian'] and settings['model_engine'] != 'sparse':
+            argdict['jacobian'] = mg.getJacobian()
+            argdict['sparsity'] = None
+        else:
+            ## The Jacobian is approximated by finite differences,
+            ## only the entries allowed by the regulatory graph
+            argdict['jacobian'] = None
+            if settings['model_engine'] == 'sparse':
+                argdict['sparsity'] = Model.jacobianSparsity()
+            else:
+                argdict['sparsity'] = CompiledModel(mg).jacobianSparsity()
+    else:
+        argdict['jacobian'] = None
+        argdict['sparsity'] = None
+    if settings['implicit_degradation']:
+        ## Index of the degradation rate of each variable in pars
+        parindex = {p:i for i, p in enumerate(parNames)}
+        argdict['decayIndex'] = [parindex[p] for p in mg.getDegradationParameters()]
+    else:
+        argdict['decayIndex'] = None
+    ## Detects simulations going to the 0 steady state
+    argdict['collapse'] = simulator.CollapseCheck(rnaIndex,
+                                                  0.1*mg.kineticParameterDefaults['x_max'])
+    if settings['early_rejection']:
+        ## Such simulations are aborted as soon as this is detected
+        argdict['reject'] = argdict['collapse']
+    else:
+        argdict['reject'] = None
 
     if settings['sample_cells']:
         # pre-define the time points from which a cell will be sampled
         # per simulation
-        sampleAt = np.random.choice(timeIndex, size=settings['num_cells'])
+        rng = utils.getGenerator(settings['seed'], utils.SAMPLING_STREAM, 0)
+        sampleAt = rng.choice(timeIndex, size=settings['num_cells'])
         header = ['E' + str(cellid) + '_' + str(time) \
                   for cellid, time in\
                   zip(range(settings['num_cells']), sampleAt)]
@@ -148,43 +225,111 @@ def Experiment(mg, Model,
     if not os.path.exists(simfilepath):
         print(simfilepath, "does not exist, creating it...")
         os.makedirs(simfilepath)
+    store = TrajectoryStore(simfilepath)
+    # Remove the store of a previous run, so that
+    # post processing does not read stale trajectories
+    store.remove()
+
+    ## Simulated trajectories are collected in memory, genes x time points x cells.
+    ## Per-cell csv files are an optional side output, written in the
+    ## background while the remaining cells are simulated.
+    trajectories = np.zeros((len(mg.genelist), len(timeIndex) - 1, settings['num_cells']))
+    sampledCells = {}
+    writer = ThreadPoolExecutor(max_workers=1)
+    writes = []
+    ## Simulations of each cell, and time steps
+    ## spent on rejected simulations
+    attempts = np.zeros(settings['num_cells'], dtype=int)
+    wastedSteps = np.zeros(settings['num_cells'], dtype=int)
+    def collect(output):
+        cellid, subset, sampledf, attempts[cellid], wastedSteps[cellid] = output
+        trajectories[:, :, cellid] = subset
+        if sampledf is not None:
+            sampledCells[cellid] = sampledf
+        if settings['trajectory_store'] == 'csv':
+            writes.append(writer.submit(writeCellFiles, argdict, cellid, subset, sampledf))
+        
     print('Starting simulations')
     start = time.time()
 
-    if settings['doParallel']:
-        with mp.Pool() as pool:
-            jobs = []
-            for cellid in range(settings['num_cells']):
-                cell_args = dict(argdict, seed=cellid, cellid=cellid)
-                job = pool.apply_async(simulateAndSample, args=(cell_args,))
-                jobs.append(job)
-                
-            for job in jobs:
-                job.wait()
+    mode = simulationMode(settings)
+    if settings['ensemble'] and settings['integrator'] == 'adaptive':
+        print("The adaptive integrator does not support ensemble, simulating one cell at a time")
+    if mode == 'parallel' and pool is None and mp.current_process().daemon:
+        # Workers of a pool cannot create a pool of their own
+        print("%s: a job run in a worker process cannot use do_parallel,"
+              " simulating one cell at a time" % settings['name'])
+        mode = 'serial'
+    if mode == 'deterministic':
+        for output in simulateDeterministicCells(argdict, settings['num_cells'],
+                                                 settings['batch_size']):
+            collect(output)
+    elif mode == 'ensemble':
+        for output in simulateEnsemble(argdict, settings['num_cells'], settings['batch_size']):
+            collect(output)
+    elif mode == 'parallel':
+        ## The simulation arguments are written to a file, which every
+        ## worker loads once. Tasks only carry the file and the cell ID.
+        argsPath = writeWorkerArgs(argdict)
+        ownPool = pool is None
+        if ownPool:
+            pool = createPool(settings['num_workers'], settings['start_method'])
+        try:
+            chunksize = settings['chunksize']
+            if chunksize is None:
+                num_workers = settings['num_workers'] or os.cpu_count()
+                chunksize = max(1, settings['num_cells'] // (4*num_workers))
+            tasks = [(argsPath, cellid) for cellid in range(settings['num_cells'])]
+            for output in tqdm(pool.imap_unordered(simulateCell, tasks, chunksize=chunksize),
+                               total=settings['num_cells']):
+                collect(output)
+        finally:
+            if ownPool:
+                pool.close()
+                pool.join()
+            os.remove(argsPath)
     else:
         for cellid in tqdm(range(settings['num_cells'])):
-            argdict['seed'] = cellid
             argdict['cellid'] = cellid
-            simulateAndSample(argdict)
+            collect(simulateAndSample(argdict))
 
     print("Simulations took %0.3f s"%(time.time() - start))
-    frames = []
-    print('starting to concat files')
+    print("Accepted %d of %d simulations (acceptance rate %.1f%%), %d retries, "
+          "%d time steps spent on rejected simulations"\
+          %(settings['num_cells'], attempts.sum(),
+            100.*settings['num_cells']/max(attempts.sum(), 1),
+            attempts.sum() - settings['num_cells'], wastedSteps.sum()))
+    print('starting to concat trajectories')
     start = time.time()
 
-    for cellid in tqdm(range(settings['num_cells'])):
-        if settings['sample_cells']:
-            df = pd.read_csv(outPrefix + '/simulations/E'+str(cellid) + '-cell.csv',index_col=0)
-            df = df.sort_index()                
-        else:
-            df = pd.read_csv(outPrefix + '/simulations/E'+str(cellid) + '.csv',index_col=0)
-            df = df.sort_index()
-            groupedDict['E' + str(cellid)] = df.values.ravel()
-        frames.append(df.T)
+    if settings['sample_cells']:
+        frames = [sampledCells[cellid].sort_index().T for cellid in range(settings['num_cells'])]
+        result = pd.concat(frames,axis=0)
+        result = result.T
+    else:
+        genes = mg.genelist
+        timepoints = timeIndex[1:]
+        # Rows are sorted by gene name
+        order = sorted(range(len(genes)), key=lambda i: genes[i])
+        sortedTrajectories = trajectories[order]
+        for cellid in range(settings['num_cells']):
+            groupedDict['E' + str(cellid)] = sortedTrajectories[:, :, cellid].ravel()
+        result = pd.DataFrame(sortedTrajectories.transpose(0, 2, 1).reshape(len(genes), -1),
+                              index=pd.Index([genes[i] for i in order]),
+                              columns=['E' + str(cellid) + '_' + str(t)\
+                                       for cellid in range(settings['num_cells'])\
+                                       for t in timepoints])
     stop = time.time()
-    print("Concating files took %.2f s" %(stop-start))
-    result = pd.concat(frames,axis=0)
-    result = result.T
+    print("Concating trajectories took %.2f s" %(stop-start))
+
+    start = time.time()
+    if settings['trajectory_store'] == 'npy':
+        store.save(mg.genelist, timeIndex[1:], trajectories)
+    # Wait for the background writes to finish
+    writer.shutdown(wait=True)
+    for write in writes:
+        write.result()
+    print("Writing trajectories took %.2f s" %(time.time() - start))
     indices = result.index
     newindices = [i.replace('x_','') for i in indices]
     result.index = pd.Index(newindices)
@@ -209,11 +354,19 @@ def Experiment(mg, Model,
     
     return result
     
-def startRun(settings):
+def startRun(settings, pool=None):
     """
     Start a simulation run. Loads model file, starts an Experiment(),
     and generates the appropriate input files
+
+    :param settings: The job settings dictionary
+    :type settings: dict
+    :param pool: Worker pool shared between jobs, used if do_parallel is True
+    :type pool: multiprocessing.pool.Pool
     """
+    # Floating point error handling is specific to each thread,
+    # and jobs may be run in separate threads
+    np.seterr(all='raise')
     validInput = utils.checkValidModelDefinitionPath(settings['modelpath'], settings['name'])
     startfull = time.time()
 
@@ -222,40 +375,30 @@ def startRun(settings):
         print(outdir, "does not exist, creating it...")
         os.makedirs(outdir)
         
-    ##########################################
-    ## Read advanced model specification files
-    ## If these are not specified, the dataFrame objects
-    ## are left empty
-    parameterInputsDF = utils.checkValidInputPath(settings['parameter_inputs_path'])
-    parameterSetDF = utils.checkValidInputPath(settings['parameter_set'])
-    icsDF = utils.checkValidInputPath(settings['icsPath'])
-    interactionStrengthDF = utils.checkValidInputPath(settings['interaction_strengths'])
-
-    speciesTypeDF = utils.checkValidInputPath(settings['species_type'])
-    ##########################################
+    mg, parameterInputsDF, icsDF = loadModel(settings)
 
     # Simulator settings
     tmax = settings['simulation_time']    
     integration_step_size = settings['integration_step_size']
     tspan = np.linspace(0,tmax,int(tmax/integration_step_size))
-
-    # Generate the ODE model from the specified boolean model
-    mg = GenerateModel(settings,
-                       parameterInputsDF,
-                       parameterSetDF,
-                       interactionStrengthDF)
     genesDict = {}
 
-    # Load the ODE model file
-    model = SourceFileLoader("model", mg.path_to_ode_model.as_posix()).load_module()
+    # Construct the ODE model in memory
+    if settings['model_engine'] == 'compiled':
+        Model = CompiledModel(mg)
+    elif settings['model_engine'] == 'sparse':
+        Model = SparseModel(mg)
+    else:
+        Model = mg.getModel()
 
     ## Function call - do the in silico experiment
-    resultDF = Experiment(mg, model.Model,
+    resultDF = Experiment(mg, Model,
                           tspan,
                           settings,
                           icsDF,
                           writeProtein=settings['writeProtein'],
-                          normalizeTrajectory=settings['normalizeTrajectory'])
+                          normalizeTrajectory=settings['normalizeTrajectory'],
+                          pool=pool)
     
     # Write simulation output. Creates ground truth files.
     print('Generating input files for pipline...')
@@ -265,16 +408,183 @@ def startRun(settings):
                              parameterInputsDF,
                              tmax,
                              settings['num_cells'],
-                             outPrefix=settings['outprefix'])
+                             outPrefix=settings['outprefix'],
+                             rng=utils.getGenerator(settings['seed'], utils.SAMPLING_STREAM, 1))
     print('Input file generation took %0.2f s' % (time.time() - start))
     print("BoolODE.py took %0.2fs"% (time.time() - startfull))
 
+def loadModel(settings):
+    """
+    Reads the model inputs of a job, and generates the ODE model
+    from the Boolean model, or reuses the model of an earlier job
+    with the same model inputs if model_cache is True.
+
+    :param settings: The job settings dictionary
+    :type settings: dict
+    :returns:
+        - mg: The model, see GenerateModel
+        - parameterInputsDF: User specified parameter inputs, empty if not specified
+        - icsDF: User specified initial conditions, empty if not specified
+    """
+    ##########################################
+    ## Read advanced model specification files
+    ## If these are not specified, the dataFrame objects
+    ## are left empty
+    parameterInputsDF = utils.checkValidInputPath(settings['parameter_inputs_path'])
+    parameterSetDF = utils.checkValidInputPath(settings['parameter_set'])
+    icsDF = utils.checkValidInputPath(settings['icsPath'])
+    interactionStrengthDF = utils.checkValidInputPath(settings['interaction_strengths'])
+
+    speciesTypeDF = utils.checkValidInputPath(settings['species_type'])
+    ##########################################
+
+    # Generate the ODE model from the specified boolean model
+    if settings['model_cache']:
+        # Reuse the model of an earlier job with the same model inputs
+        cache = ModelCache(Path(settings['outprefix']).parent / '.model_cache')
+        mg = cache.get(settings,
+                       parameterInputsDF,
+                       parameterSetDF,
+                       interactionStrengthDF)
+    else:
+        mg = GenerateModel(settings,
+                           parameterInputsDF,
+                           parameterSetDF,
+                           interactionStrengthDF)
+    return mg, parameterInputsDF, icsDF
+
+def startAttractorAnalysis(settings):
+    """
+    Finds the attractors of the model of a job before simulating it,
+    see attractors.analyzeAttractors(), writes them to the output folder
+    of the job, and prints the recommended nClusters and simulation_time.
+
+    :param settings: The job settings dictionary
+    :type settings: dict
+    """
+    np.seterr(all='raise')
+    utils.checkValidModelDefinitionPath(settings['modelpath'], settings['name'])
+    start = time.time()
+    mg, parameterInputsDF, icsDF = loadModel(settings)
+    rnaIndex = [i for i in range(len(mg.varmapper.keys())) if 'x_' in mg.varmapper[i]]
+    proteinIndex = [i for i in range(len(mg.varmapper.keys())) if 'p_' in mg.varmapper[i]]
+    revvarmapper = {v:k for k,v in mg.varmapper.items()}
+    y0 = simulator.getInitialCondition(getInitialGuess(mg, icsDF), mg.ModelSpec,
+                                       rnaIndex, proteinIndex,
+                                       mg.genelist, mg.proteinlist,
+                                       mg.varmapper, revvarmapper)
+    analysis = attractors.analyzeAttractors(mg, y0,
+                                            maxTime=max(100., settings['simulation_time']),
+                                            stepSize=settings['integration_step_size'],
+                                            seed=settings['seed'])
+    attractors.writeAttractors(analysis, mg, settings['outprefix'])
+    numCycles = len([states for states, basin in analysis['attractors'] if len(states) > 1])
+    print("%s: %d Boolean fixed points, %d Boolean cycles, %d stable steady states,"
+          " of which %d with all genes OFF"\
+          % (settings['name'], len(analysis['attractors']) - numCycles, numCycles,
+             analysis['stable'].sum(), (analysis['stable'] & analysis['collapsed']).sum()))
+    numPending = np.isnan(analysis['arrivalTimes']).sum()
+    if numPending > 0:
+        print("%s: %d of %d simulations did not reach a stable steady state by t=%g"\
+              % (settings['name'], numPending, len(analysis['arrivalTimes']),
+                 max(100., settings['simulation_time'])))
+    if analysis['simulation_time'] is None:
+        print("%s: recommended settings nClusters: %d, no simulation_time is recommended"\
+              % (settings['name'], analysis['nClusters']))
+    else:
+        print("%s: recommended settings nClusters: %d, simulation_time: %g"\
+              % (settings['name'], analysis['nClusters'], analysis['simulation_time']))
+    print("Attractor analysis took %0.2f s" % (time.time() - start))
+
+def simulationMode(settings):
+    """
+    Decides how the cells of a job are simulated: 'deterministic'
+    (without noise, see simulateDeterministicCells()), 'ensemble'
+    (in batches, see simulateEnsemble()), 'parallel' (one cell at a
+    time in the worker pool, see simulateCell()) or 'serial' (one cell
+    at a time, see simulateAndSample()). The adaptive integrator does
+    not support ensemble, and simulates one cell at a time instead.
+
+    :param settings: The job settings dictionary
+    :type settings: dict
+    :returns:
+        - mode: str
+    """
+    if settings['deterministic']:
+        return 'deterministic'
+    if settings['ensemble'] and settings['integrator'] != 'adaptive':
+        return 'ensemble'
+    if settings['doParallel']:
+        return 'parallel'
+    return 'serial'
+
+def createPool(num_workers=None, start_method=None):
+    """
+    Creates the pool of worker processes used to simulate
+    cells in parallel. A single pool can be shared by all jobs.
+
+    :param num_workers: Number of worker processes. If None, one per CPU
+    :type num_workers: int
+    :param start_method: Start method of the workers, one of 'fork', 'spawn' or 'forkserver'. If None, the platform default is used.
+    :type start_method: str
+    :returns:
+        - pool: multiprocessing.pool.Pool
+    """
+    if mp.current_process().daemon:
+        raise RuntimeError("A worker process of the pool cannot create a pool")
+    return mp.get_context(start_method).Pool(num_workers)
+
+## Simulation arguments of the jobs simulated by a worker
+## process, keyed by the file they were loaded from.
+## The file is removed when the job is finished.
+workerArgs = {}
+
+def writeWorkerArgs(argdict):
+    """
+    Writes the simulation arguments of a job to a file
+    in ./simulations/, from which they are loaded by the
+    worker processes.
+
+    :param argdict: Dictionary of simulation arguments, constructed in Experiment()
+    :type argdict: dict
+    :returns:
+        - argsPath: Path of the written file
+    """
+    argsPath = os.path.join(argdict['outPrefix'], 'simulations',
+                            '.args-' + uuid.uuid4().hex + '.pkl')
+    with open(argsPath, 'wb') as out:
+        pickle.dump(argdict, out)
+    return argsPath
+
+def simulateCell(task):
+    """
+    Simulates a single cell in a worker process. The simulation
+    arguments of the job are loaded the first time the worker
+    simulates a cell of the job, at which point the arguments
+    of the jobs that have finished are released.
+
+    :param task: Tuple (path written by writeWorkerArgs(), cellid)
+    :type task: tuple
+    :returns:
+        - output: Tuple, see simulateAndSample()
+    """
+    argsPath, cellid = task
+    if argsPath not in workerArgs:
+        # Arguments of finished jobs are released
+        for path in [path for path in workerArgs if not os.path.exists(path)]:
+            del workerArgs[path]
+        with open(argsPath, 'rb') as infile:
+            workerArgs[argsPath] = pickle.load(infile)
+    return simulateAndSample(dict(workerArgs[argsPath], cellid=cellid))
+
 def simulateAndSample(argdict):
     """
     Handles parallelization of ODE simulations.
     Calls the simulator with simulation settings.
+
+    :returns:
+        - output: Tuple (cellid, trajectory, sampled cell, number of simulations, time steps spent on rejected simulations), see extractTrajectory()
     """
-    mg = argdict['mg']
     allParameters = argdict['allParameters']
     parNames = argdict['parNames']
     Model = argdict['Model']
@@ -294,75 +604,242 @@ def simulateAndSample(argdict):
     genelist = argdict['genelist']
     proteinlist = argdict['proteinlist']
     revvarmapper = argdict['revvarmapper']
-    seed = argdict['seed']
-    pars = argdict['pars']
+    if argdict['cellPars'] is None:
+        pars = argdict['pars']
+    else:
+        pars = argdict['cellPars'][cellid]
+    if argdict['decayIndex'] is None:
+        decay = None
+    else:
+        decay = pars[argdict['decayIndex']]
     x_max = argdict['x_max']
-    
-    # Retained for debugging
-    isStochastic = True
+    isStochastic = argdict['isStochastic']
     
     if sampleCells:
         header = argdict['header']
         
-    pars = {}
-    for k, v in allParameters.items():
-        pars[k] = v
-    pars = [pars[k] for k in parNames]
-    
+    ## Every cell draws from its own stream of random numbers,
+    ## which is continued if the simulation has to be repeated
+    rng = utils.getGenerator(argdict['seed'], utils.CELL_STREAM, cellid)
     ## Boolean to check if a simulation is going to a
     ## 0 steady state, with all genes/proteins dying out
     retry = True
     trys = 0
-    ## timepoints
-    tps = [i for i in range(1,len(tspan))]
-    ## gene ids
-    gid = [i for i,n in varmapper.items() if 'x_' in n]
-    outPrefix = outPrefix + '/simulations/'
+    # Number of time steps spent on rejected simulations
+    wasted = 0
     while retry:
-        seed += 1000
         y0_exp = simulator.getInitialCondition(ss, ModelSpec, rnaIndex, proteinIndex,
                                      genelist, proteinlist,
                                      varmapper,revvarmapper)
         
-        P = simulator.simulateModel(Model, y0_exp, pars, isStochastic, tspan, seed)
-        P = P.T
-        retry = False
-        ## Extract Time points
-        subset = P[gid,:][:,tps]
-        df = pd.DataFrame(subset,
-                          index=pd.Index(genelist),
-                          columns = ['E' + str(cellid) +'_' +str(i)\
-                                     for i in tps])
-        df.to_csv(outPrefix + 'E' + str(cellid) + '.csv')        
-        ## Heuristic:
-        ## If the largest value of a protein achieved in a simulation is
-        ## less than 10% of the y_max, drop the simulation.
-        ## This check stems from the observation that in some simulations,
-        ## all genes go to the 0 steady state in some rare simulations.
-        dfmax = df.max()
-        for col in df.columns:
-            colmax = df[col].max()
-            if colmax < 0.1*x_max:
-                retry= True
-                break
-        
-        if sampleCells:
-            ## Write a single cell to file
-            ## These samples allow for quickly and
-            ## reproducibly testing the output.
-            sampledf = utils.sampleCellFromTraj(cellid,
-                                          tspan, 
-                                          P,
-                                          varmapper, timeIndex,
-                                          genelist, proteinlist,
-                                          header,
-                                          writeProtein=writeProtein)
-            sampledf = sampledf.T
-            sampledf.to_csv(outPrefix + 'E' + str(cellid) + '-cell.csv')            
-            
+        output = simulator.simulateModel(Model, y0_exp, pars, isStochastic, tspan, rng,
+                                         boundary=argdict['boundary'],
+                                         chunk_size=argdict['chunk_size'],
+                                         record_every=argdict['record_every'],
+                                         reject=argdict['reject'],
+                                         integrator=argdict['integrator'],
+                                         rtol=argdict['rtol'],
+                                         atol=argdict['atol'],
+                                         milstein=argdict['milstein'],
+                                         decay=decay,
+                                         jacobian=argdict['jacobian'])
+        if argdict['reject'] is None:
+            P, rejected, steps = output, False, len(tspan) - 1
+        else:
+            P, rejected, steps = output
         trys += 1
-        # write to file
-        df.to_csv(outPrefix + 'E' + str(cellid) + '.csv')
+        if rejected:
+            # Aborted early, the simulation is repeated
+            retry = True
+        else:
+            # A deterministic simulation would collapse again
+            subset, sampledf, retry = extractTrajectory(argdict, cellid, P.T,
+                                                        checkCollapse=isStochastic)
+        if retry:
+            wasted += steps
         
         if trys > 1:
             print('try', trys)
+    return (cellid, subset, sampledf, trys, wasted)
+
+def simulateEnsemble(argdict, num_cells, batch_size):
+    """
+    Simulates all cells as batched ensembles instead of one
+    cell at a time. The states of the cells in a batch are
+    advanced together by simulator.simulateModelEnsemble().
+    Cells whose simulations go to the 0 steady state are
+    simulated again in a later batch, continuing their
+    stream of random numbers as in simulateAndSample().
+
+    :returns:
+        - output: Generator of tuples (cellid, trajectory, sampled cell, number of simulations, time steps spent on rejected simulations), one per accepted cell
+    """
+    Model = argdict['Model']
+    tspan = argdict['tspan']
+    pars = argdict['pars']
+    decayIndex = argdict['decayIndex']
+    decay = None if decayIndex is None else pars[decayIndex]
+    y0_exp = simulator.getInitialCondition(argdict['ss'], argdict['ModelSpec'],
+                                           argdict['rnaIndex'], argdict['proteinIndex'],
+                                           argdict['genelist'], argdict['proteinlist'],
+                                           argdict['varmapper'], argdict['revvarmapper'])
+    rngs = {cellid:utils.getGenerator(argdict['seed'], utils.CELL_STREAM, cellid)\
+            for cellid in range(num_cells)}
+    trys = {cellid:0 for cellid in range(num_cells)}
+    wasted = {cellid:0 for cellid in range(num_cells)}
+    pending = list(range(num_cells))
+    while len(pending) > 0:
+        retries = []
+        for start in tqdm(range(0, len(pending), batch_size)):
+            batch = pending[start:start + batch_size]
+            y0 = np.tile(y0_exp, (len(batch), 1))
+            if argdict['cellPars'] is not None:
+                # One column of parameters per cell
+                pars = np.ascontiguousarray(argdict['cellPars'][batch].T)
+                if decayIndex is not None:
+                    decay = argdict['cellPars'][batch][:, decayIndex]
+            output = simulator.simulateModelEnsemble(Model, y0, pars, tspan,
+                                                     [rngs[cellid] for cellid in batch],
+                                                     boundary=argdict['boundary'],
+                                                     chunk_size=argdict['chunk_size'],
+                                                     record_every=argdict['record_every'],
+                                                     reject=argdict['reject'],
+                                                     milstein=argdict['milstein'],
+                                                     decay=decay)
+            if argdict['reject'] is None:
+                P = output
+                rejected = np.zeros(len(batch), dtype=bool)
+                steps = np.full(len(batch), len(tspan) - 1)
+            else:
+                P, rejected, steps = output
+            for j, cellid in enumerate(batch):
+                trys[cellid] += 1
+                if rejected[j]:
+                    retry = True
+                else:
+                    subset, sampledf, retry = extractTrajectory(argdict, cellid, P[:, j, :].T)
+                if retry:
+                    retries.append(cellid)
+                    wasted[cellid] += int(steps[j])
+                else:
+                    yield (cellid, subset, sampledf, trys[cellid], wasted[cellid])
+                if trys[cellid] > 1:
+                    print('try', trys[cellid])
+        pending = retries
+
+def simulateDeterministicCells(argdict, num_cells, batch_size):
+    """
+    Simulates all cells without noise. Cells sharing an initial
+    condition and a set of parameters have the same time course,
+    which is computed once and reused for all of them. The distinct
+    time courses are integrated together, batch_size at a time,
+    by simulator.simulateDeterministic().
+
+    :returns:
+        - output: Generator of tuples (cellid, trajectory, sampled cell, number of simulations, time steps spent on rejected simulations), one per cell
+    """
+    tspan = argdict['tspan']
+    y0_exp = simulator.getInitialCondition(argdict['ss'], argdict['ModelSpec'],
+                                           argdict['rnaIndex'], argdict['proteinIndex'],
+                                           argdict['genelist'], argdict['proteinlist'],
+                                           argdict['varmapper'], argdict['revvarmapper'])
+    y0_exp = np.asarray(y0_exp, dtype=float)
+    if argdict['cellPars'] is None:
+        cellPars = np.tile(argdict['pars'], (num_cells, 1))
+    else:
+        cellPars = argdict['cellPars']
+    ## One row per cell, initial condition followed by parameters
+    runs = np.hstack([np.tile(y0_exp, (num_cells, 1)), cellPars])
+    distinct, group = np.unique(runs, axis=0, return_inverse=True)
+    group = group.ravel()
+    d = len(y0_exp)
+    print("Simulating %d distinct time courses for %d cells" % (len(distinct), num_cells))
+    for start in tqdm(range(0, len(distinct), batch_size)):
+        batch = distinct[start:start + batch_size]
+        P = simulator.simulateDeterministic(argdict['Model'], batch[:, :d],
+                                            np.ascontiguousarray(batch[:, d:].T), tspan,
+                                            jacobian=argdict['jacobian'],
+                                            sparsity=argdict['sparsity'],
+                                            record_every=argdict['record_every'])
+        collapsed = argdict['collapse'](P[1:])
+        for j in range(len(batch)):
+            if collapsed[j]:
+                print("Warning: deterministic time course %d goes to the 0 steady state" % (start + j))
+            for cellid in np.flatnonzero(group == start + j):
+                subset, sampledf, _ = extractTrajectory(argdict, int(cellid), P[:, j, :].T,
+                                                        checkCollapse=False)
+                yield (int(cellid), subset, sampledf, 1, 0)
+
+def extractTrajectory(argdict, cellid, P, checkCollapse=True):
+    """
+    Extracts the time course of the genes from the simulation
+    of a single cell, and checks if the simulation has to be
+    repeated. If sample_cells is True, a single time point
+    is also sampled from the simulation.
+
+    :param argdict: Dictionary of simulation arguments, constructed in Experiment()
+    :type argdict: dict
+    :param cellid: ID of the simulated cell
+    :type cellid: int
+    :param P: Time course of the cell, with one row per state variable and one column per recorded time point
+    :type P: ndarray
+    :param checkCollapse: If False, the simulation is never repeated
+    :type checkCollapse: bool
+    :returns:
+        - subset: Array of shape (genes, time points) containing the time course of the genes
+        - sampledf: DataFrame containing the sampled cell, None if sample_cells is False
+        - retry: True if the simulation went to the 0 steady state, and has to be repeated
+    """
+    tspan = argdict['tspan']
+    varmapper = argdict['varmapper']
+    genelist = argdict['genelist']
+    sampledf = None
+    ## Extract the time course of the genes,
+    ## excluding the initial condition
+    subset = P[argdict['rnaIndex'], 1:]
+    ## Heuristic:
+    ## If the largest value of a gene achieved at some time point
+    ## is less than 10% of the x_max, drop the simulation.
+    ## This check stems from the observation that in some simulations,
+    ## all genes go to the 0 steady state in some rare simulations.
+    retry = checkCollapse and bool(argdict['collapse'](P[:, 1:].T))
+    if retry:
+        return subset, sampledf, retry
+    
+    if argdict['sampleCells']:
+        ## Sample a single cell
+        ## These samples allow for quickly and
+        ## reproducibly testing the output.
+        sampledf = utils.sampleCellFromTraj(cellid,
+                                      tspan, 
+                                      P,
+                                      varmapper, argdict['timeIndex'],
+                                      genelist, argdict['proteinlist'],
+                                      argdict['header'],
+                                      writeProtein=argdict['writeProtein'])
+        sampledf = sampledf.T
+    return subset, sampledf, retry
+
+def writeCellFiles(argdict, cellid, subset, sampledf):
+    """
+    Writes the simulated time course of a single cell to
+    ./simulations/E<cellid>.csv. If sample_cells is True,
+    the sampled cell is written to ./simulations/E<cellid>-cell.csv.
+
+    :param argdict: Dictionary of simulation arguments, constructed in Experiment()
+    :type argdict: dict
+    :param cellid: ID of the simulated cell
+    :type cellid: int
+    :param subset: Array of shape (genes, time points) containing the time course of the genes
+    :type subset: ndarray
+    :param sampledf: DataFrame containing the sampled cell, or None
+    :type sampledf: pandas DataFrame
+    """
+    outPrefix = argdict['outPrefix'] + '/simulations/'
+    df = pd.DataFrame(subset,
+                      index=pd.Index(argdict['genelist']),
+                      columns = ['E' + str(cellid) +'_' +str(i)\
+                                 for i in range(1, subset.shape[1] + 1)])
+    df.to_csv(outPrefix + 'E' + str(cellid) + '.csv')
+    if sampledf is not None:
+        sampledf.to_csv(outPrefix + 'E' + str(cellid) + '-cell.csv')
@@ -1,23 +1,119 @@
 import numpy as np
+from scipy import sparse
+from scipy.integrate import odeint, solve_ivp
+
+# Strength of the noise, see noise()
+NOISE_STRENGTH = 10.#4.
 
 def noise(x,t):
     # Controls noise proportional to
     # square root of activity
-    c = 10.#4.
+    c = NOISE_STRENGTH
     return (c*np.sqrt(abs(x)))
 
-def deltaW(N, m, h,seed=0):
+def noiseCorrection(x,t):
+    """
+    Returns 0.5*G*dG/dx for the noise G = c*sqrt(|x|) of noise(),
+    the coefficient of the Milstein correction
+    0.5*G*dG/dx*(dW^2 - dt). Since dG/dx = c*sign(x)/(2*sqrt(|x|)),
+    this is c^2*sign(x)/4, and does not diverge at x = 0.
+    """
+    c = NOISE_STRENGTH
+    return 0.25*c**2*np.sign(x)
+
+def deltaW(N, m, h, rng):
     """Generate sequence of Wiener increments for m independent Wiener
     processes W_j(t) j=0..m-1 for each of N time intervals of length h.    
     From the sdeint implementation
 
+    :param rng: Random number generator of the simulated cell
+    :type rng: numpy.random.Generator
     :returns:
         - dW : The [n, j] element has the value W_j((n+1)*h) - W_j(n*h) ( has shape (N, m) )
     """
-    np.random.seed(seed)
-    return np.random.normal(0.0, h, (N, m))
+    return rng.normal(0.0, h, (N, m))
+
+def applyBoundary(ynext, yn, boundary='hold'):
+    """
+    Ensure that the state variables stay positive after an
+    integration step. Negative entries of ynext are modified
+    in place according to one of the following policies:
+
+    1. 'hold' - reset the entry to its value at the previous step
+    2. 'reflect' - reflect the entry about 0
+    3. 'truncate' - set the entry to 0
+
+    :param ynext: State after the integration step
+    :type ynext: ndarray
+    :param yn: State before the integration step
+    :type yn: ndarray
+    :param boundary: One of 'hold', 'reflect' or 'truncate'. Default = 'hold'
+    :type boundary: str
+    :returns:
+        - ynext: The modified state
+    """
+    if boundary == 'hold':
+        np.copyto(ynext, yn, where=ynext < 0)
+    elif boundary == 'reflect':
+        np.abs(ynext, out=ynext)
+    elif boundary == 'truncate':
+        np.maximum(ynext, 0., out=ynext)
+    else:
+        raise ValueError("boundary_policy should be one of "
+                         "['hold', 'reflect', 'truncate'], got " + str(boundary))
+    return ynext
+
+def wienerIncrements(N, m, h, rng, chunk_size=1000):
+    """Streaming variant of deltaW(). Generates the same sequence of
+    Wiener increments as deltaW(N, m, h, rng), but yields them in chunks
+    of at most chunk_size time intervals, so that the full (N, m) array
+    is never held in memory.
+
+    :param N: Number of time intervals
+    :type N: int
+    :param m: Number of independent Wiener processes
+    :type m: int
+    :param h: Length of each time interval
+    :type h: float
+    :param rng: Random number generator of the simulated cell
+    :type rng: numpy.random.Generator
+    :param chunk_size: Maximum number of time intervals per chunk
+    :type chunk_size: int
+    :returns:
+        - dW : generator of arrays of shape (<= chunk_size, m)
+    """
+    for start in range(0, N, chunk_size):
+        yield rng.normal(0.0, h, (min(chunk_size, N - start), m))
+
+class CollapseCheck:
+    """Rejection predicate which detects simulations going to the 0
+    steady state: a simulation is rejected if, at any recorded time point
+    after the initial condition, all of the given variables are below
+    a threshold.
+
+    An instance can be passed as the reject argument of eulersde() and
+    eulersdeEnsemble().
 
-def eulersde(f,G,y0,tspan,pars,seed=0.,dW=None):
+    :param index: Indices of the checked state variables, typically the mRNA variables
+    :type index: list
+    :param threshold: The simulation is rejected if all checked variables are below this value
+    :type threshold: float
+    """
+    def __init__(self, index, threshold) -> None:
+        self.index = np.asarray(index, dtype=int)
+        self.threshold = threshold
+
+    def __call__(self, y):
+        """
+        :param y: Recorded states, of shape (time points, d) or (time points, num_cells, d)
+        :type y: ndarray
+        :returns:
+            - reject: True if the simulation has to be rejected, one value per cell for an ensemble
+        """
+        return (y[..., self.index].max(axis=-1) < self.threshold).any(axis=0)
+
+def eulersde(f,G,y0,tspan,pars,rng=None,dW=None,boundary='hold',
+             chunk_size=1000,record_every=1,reject=None,GdG=None,decay=None):
     """
     Adapted from sdeint implementation https://github.com/mattja/sdeint/
 
@@ -29,40 +125,406 @@ def eulersde(f,G,y0,tspan,pars,seed=0.,dW=None):
     :type y0: list
     :param tspan: Array of timepoints to simulate
     :type tspan: ndarray
-    :param seed: Seed to initialize random number generator
-    :type seed: float
+    :param rng: Random number generator of the simulated cell. If None, a freshly seeded generator is used.
+    :type rng: numpy.random.Generator
+    :param boundary: Policy used to keep state variables positive, see applyBoundary()
+    :type boundary: str
+    :param chunk_size: Number of time steps for which Wiener increments are generated at once
+    :type chunk_size: int
+    :param record_every: Only every record_every-th time point is stored
+    :type record_every: int
+    :param reject: Rejection predicate, e.g. CollapseCheck. It is called with the states recorded since the last check, after every chunk of time steps, and the simulation is aborted as soon as it returns True. The initial condition is not checked.
+    :type reject: function
+    :param GdG: Function returning 0.5*G*dG/dx, e.g. noiseCorrection(). If given, the Milstein correction GdG*(dW^2 - h^2) is added to each step, where the increments dW have a standard deviation of h.
+    :type GdG: function
+    :param decay: Rates of the linear degradation terms -decay*y contained in f, one per state variable. If given, these terms are integrated implicitly, y[n+1] = (y[n] + h*(f + decay*y[n]) + G*dW)/(1 + h*decay), which remains stable for step sizes at which the explicit steps do not.
+    :type decay: ndarray
     :returns:
-        - y: Array containing the time course of state variables 
+        - y: Array containing the time course of state variables at tspan[::record_every]
+        - rejected: Only returned if reject is given. True if the simulation was aborted.
+        - steps: Only returned if reject is given. Number of time steps taken.
     """
     # From sdeint implementation
     N = len(tspan)
     h = (tspan[N-1] - tspan[0])/(N - 1)
-    maxtime = tspan[-1]
-    # allocate space for result
+    # allocate space for the recorded time points only
     d = len(y0)
-    y = np.zeros((N+1, d), dtype=type(y0[0]))
+    y = np.zeros((len(range(0, N, record_every)), d))
+
+    if dW is None:
+        # stream Wiener increments (for d independent Wiener processes):
+        if rng is None:
+            rng = np.random.default_rng()
+        dW = wienerIncrements(N, d, h, rng, chunk_size=chunk_size)
+    else:
+        dW = [dW]
+    yn = np.array(y0, dtype=float)
+    y[0] = yn
+    n = 0
+    checked = 1
+
+    for dWchunk in dW:
+        for dWn in dWchunk[:N - 1 - n]:
+            tn = tspan[0] + n*h
+            ynext = yn + f(yn, tn,pars)*h + np.multiply(G(yn, tn),dWn)
+            if GdG is not None:
+                ynext += GdG(yn, tn)*(dWn**2 - h**2)
+            if decay is not None:
+                ynext = (ynext + h*decay*yn)/(1. + h*decay)
+            # Ensure positive terms
+            yn = applyBoundary(ynext, yn, boundary)
+            n += 1
+            if n % record_every == 0:
+                y[n // record_every] = yn
+        if reject is not None:
+            recorded = n // record_every + 1
+            if recorded > checked and reject(y[checked:recorded]):
+                return y, True, n
+            checked = recorded
+    if reject is not None:
+        return y, False, n
+    return y
+
+def eulersdeEnsemble(f,G,y0,tspan,pars,rngs,dW=None,boundary='hold',
+                     chunk_size=1000,record_every=1,reject=None,GdG=None,decay=None):
+    """
+    Batched variant of eulersde(). Instead of integrating one trajectory
+    at a time, the states of all cells are held in a single (num_cells, d)
+    array and advanced together, so that every time step is a handful of
+    vectorized operations over the whole ensemble.
+
+    :param f: function defining ODE model. Should accept a state array of shape (d, num_cells), the current time, and list of parameter values as arguments.
+    :type f: function
+    :param y0: Array of initial values, of shape (num_cells, d)
+    :type y0: ndarray
+    :param tspan: Array of timepoints to simulate
+    :type tspan: ndarray
+    :param pars: Parameter values, either a vector shared by all cells, or an array of shape (number of parameters, num_cells) with one column per cell
+    :type pars: ndarray
+    :param rngs: List of random number generators, one per cell. The Wiener increments of each cell are generated exactly as in eulersde(), so that a cell follows the same trajectory whether it is simulated alone or as part of an ensemble.
+    :type rngs: list
+    :param boundary: Policy used to keep state variables positive, see applyBoundary()
+    :type boundary: str
+    :param chunk_size: Number of time steps for which Wiener increments are generated at once
+    :type chunk_size: int
+    :param record_every: Only every record_every-th time point is stored
+    :type record_every: int
+    :param reject: Rejection predicate, see eulersde(). It returns one value per cell, and rejected cells are removed from the ensemble, without drawing further Wiener increments from their generators.
+    :type reject: function
+    :param GdG: Function returning 0.5*G*dG/dx, used for the Milstein correction, see eulersde()
+    :type GdG: function
+    :param decay: Rates of the linear degradation terms which are integrated implicitly, see eulersde(). Either one value per state variable, or an array of shape (num_cells, d).
+    :type decay: ndarray
+    :returns:
+        - y: Array of shape (len(tspan[::record_every]), num_cells, d) containing the time course of state variables of each cell
+        - rejected: Only returned if reject is given. Boolean array, True for the cells whose simulations were aborted.
+        - steps: Only returned if reject is given. Number of time steps taken by each cell.
+    """
+    N = len(tspan)
+    h = (tspan[N-1] - tspan[0])/(N - 1)
+    y0 = np.asarray(y0, dtype=float)
+    numCells, d = y0.shape
+    # allocate space for the recorded time points only
+    y = np.zeros((len(range(0, N, record_every)), numCells, d))
 
+    pars = np.asarray(pars, dtype=float)
+    # Cells which are still simulated
+    active = np.arange(numCells)
+    rejected = np.zeros(numCells, dtype=bool)
+    steps = np.full(numCells, N - 1)
     if dW is None:
-        # pre-generate Wiener increments (for d independent Wiener processes):
-        dW = deltaW(N, d, h, seed=seed)
-    y[0] = y0
-    currtime = 0
+        # stream Wiener increments, cell by cell
+        streams = [wienerIncrements(N, d, h, rng, chunk_size=chunk_size) for rng in rngs]
+        numChunks = len(range(0, N, chunk_size))
+    else:
+        numChunks = 1
+    yn = y0.copy()
+    y[0] = yn
     n = 0
-   
-    while currtime < maxtime:
-        tn = currtime
-        yn = y[n]
-        dWn = dW[n,:]
-        y[n+1] = yn + f(yn, tn,pars)*h + np.multiply(G(yn, tn),dWn)
-        # Ensure positive terms
-        for i in range(len(y[n+1])):
-            if y[n+1][i] < 0:
-                y[n+1][i] = yn[i]
-        currtime += h
-        n += 1 
+    checked = 1
+
+    for _ in range(numChunks):
+        if len(active) == 0:
+            break
+        if dW is None:
+            dWchunk = np.stack([next(streams[c]) for c in active], axis=1)
+        else:
+            dWchunk = dW[:, active]
+        for dWn in dWchunk[:N - 1 - n]:
+            tn = tspan[0] + n*h
+            # The model expects one row per state variable
+            ynext = yn + f(yn.T, tn, pars).T*h + np.multiply(G(yn, tn), dWn)
+            if GdG is not None:
+                ynext += GdG(yn, tn)*(dWn**2 - h**2)
+            if decay is not None:
+                ynext = (ynext + h*decay*yn)/(1. + h*decay)
+            # Ensure positive terms
+            yn = applyBoundary(ynext, yn, boundary)
+            n += 1
+            if n % record_every == 0:
+                y[n // record_every, active] = yn
+        if reject is not None:
+            recorded = n // record_every + 1
+            if recorded > checked:
+                abort = np.asarray(reject(y[checked:recorded][:, active]))
+                if abort.any():
+                    rejected[active[abort]] = True
+                    steps[active[abort]] = n
+                    active = active[~abort]
+                    yn = yn[~abort]
+                    if pars.ndim > 1:
+                        pars = pars[:, ~abort]
+                    if decay is not None and np.ndim(decay) > 1:
+                        decay = decay[~abort]
+            checked = recorded
+    if reject is not None:
+        return y, rejected, steps
     return y
 
-def simulateModel(Model, y0, parameters,isStochastic, tspan,seed):
+class NormalStream:
+    """Draws standard normal vectors one at a time from a buffer
+    which is refilled in chunks, so that the generator is not
+    called at every step of an integrator.
+
+    :param rng: Random number generator of the simulated cell
+    :type rng: numpy.random.Generator
+    :param d: Length of each vector
+    :type d: int
+    :param chunk_size: Number of vectors drawn from rng at once
+    :type chunk_size: int
+    """
+    def __init__(self, rng, d, chunk_size=1000) -> None:
+        self.rng = rng
+        self.d = d
+        self.chunk_size = chunk_size
+        self.buffer = np.empty((0, d))
+        self.position = 0
+
+    def next(self):
+        """
+        :returns:
+            - z: Vector of d independent standard normal values
+        """
+        if self.position == len(self.buffer):
+            self.buffer = self.rng.standard_normal((self.chunk_size, self.d))
+            self.position = 0
+        self.position += 1
+        return self.buffer[self.position - 1]
+
+    def take(self, n):
+        """
+        :param n: Number of vectors
+        :type n: int
+        :returns:
+            - z: Array of shape (n, d) of independent standard normal values, the same values as n calls of next()
+        """
+        if self.position + n <= len(self.buffer):
+            self.position += n
+            return self.buffer[self.position - n:self.position]
+        return np.array([self.next() for i in range(n)])
+
+def eulersdeAdaptive(f,G,y0,tspan,pars,rng=None,boundary='hold',
+                     chunk_size=1000,record_every=1,reject=None,
+                     rtol=1e-2,atol=1e-2,GdG=None,decay=None):
+    """
+    Euler-Maruyama integration with adaptive step sizes.
+
+    The error of each step is estimated by step doubling: the step is
+    taken once with the full step size, and once as two half steps, and
+    the two results are compared. The two half steps are accepted if
+    max(|difference|/(atol + rtol*|y|)) <= 1, and the next step size is
+    adapted to the error. If the step is rejected, it is retried as its
+    two halves, with the same Wiener increments. Wiener increments are
+    only ever split, using the Brownian bridge, and are never redrawn,
+    so that rejected steps do not bias the simulated paths.
+
+    Step sizes do not depend on the recorded time points
+    tspan[::record_every]. The recorded states within an accepted step
+    are interpolated between the states at the start, middle and end of
+    the step, with the noise sampled from the Brownian bridge between
+    the Wiener increments of its two halves, see bridgeStates().
+
+    The noise is scaled to match eulersde(), whose increments have a
+    standard deviation of h over a step of length h. Here, G is multiplied
+    by sqrt(h), and increments have a standard deviation of sqrt(dt) over
+    a step of length dt, so that both integrators simulate the same SDE.
+
+    :param f: function defining ODE model. Should take vector of current state, current time, and list of parameter values as arguments.
+    :type f: function
+    :param G: function defining the noise amplitude of each state variable
+    :type G: function
+    :param y0: list of initial values
+    :type y0: list
+    :param tspan: Array of timepoints to simulate
+    :type tspan: ndarray
+    :param pars: List of parameter values
+    :type pars: list
+    :param rng: Random number generator of the simulated cell. If None, a freshly seeded generator is used.
+    :type rng: numpy.random.Generator
+    :param boundary: Policy used to keep state variables positive, see applyBoundary()
+    :type boundary: str
+    :param chunk_size: Number of normal vectors drawn from rng at once. The rejection predicate is checked whenever at least chunk_size/record_every new time points have been recorded.
+    :type chunk_size: int
+    :param record_every: Only every record_every-th time point is stored
+    :type record_every: int
+    :param reject: Rejection predicate, see eulersde()
+    :type reject: function
+    :param rtol: Relative tolerance of the error of a step
+    :type rtol: float
+    :param atol: Absolute tolerance of the error of a step
+    :type atol: float
+    :param GdG: Function returning 0.5*G*dG/dx, e.g. noiseCorrection(). If given, each step includes the Milstein correction h*GdG*(dW^2 - dt), whose error decreases faster with the step size, allowing larger steps.
+    :type GdG: function
+    :param decay: Rates of the linear degradation terms which are integrated implicitly, see eulersde(). The errors of the implicit steps do not grow with the degradation rates, allowing larger steps for stiff models.
+    :type decay: ndarray
+    :returns:
+        - y: Array containing the time course of state variables at tspan[::record_every]
+        - rejected: Only returned if reject is given. True if the simulation was aborted.
+        - steps: Only returned if reject is given. Number of steps attempted, each costing two evaluations of f.
+    """
+    N = len(tspan)
+    h = (tspan[N-1] - tspan[0])/(N - 1)
+    times = np.asarray(tspan, dtype=float)[::record_every]
+    d = len(y0)
+    y = np.zeros((len(times), d))
+    if rng is None:
+        rng = np.random.default_rng()
+    normals = NormalStream(rng, d, chunk_size=chunk_size)
+    scale = np.sqrt(h)
+    # The smallest step size, below which steps are always accepted
+    minStep = h/64.
+    # Tolerance of the comparison of times
+    eps = 1e-9*h
+
+    yn = np.array(y0, dtype=float)
+    y[0] = yn
+    tn = times[0]
+    dt = h
+    steps = 0
+    checked = 1
+    # Next recorded time point
+    k = 1
+    # Wiener increments of parts of rejected steps,
+    # the next part on top
+    pending = []
+    while k < len(times):
+        if len(pending) > 0:
+            step, dW = pending.pop()
+        else:
+            step = dt
+            if times[-1] - tn - step <= eps:
+                step = times[-1] - tn
+            dW = np.sqrt(step)*normals.next()
+        # Wiener increment of the first half of the step,
+        # conditional on the increment of the full step
+        dW1 = 0.5*dW + 0.5*np.sqrt(step)*normals.next()
+        dW2 = dW - dW1
+        fn = f(yn, tn, pars)
+        gn = G(yn, tn)*scale
+        full = yn + fn*step + gn*dW
+        half = yn + fn*0.5*step + gn*dW1
+        if GdG is not None:
+            cn = GdG(yn, tn)*h
+            full += cn*(dW**2 - step)
+            half += cn*(dW1**2 - 0.5*step)
+        if decay is not None:
+            full = (full + step*decay*yn)/(1. + step*decay)
+            half = (half + 0.5*step*decay*yn)/(1. + 0.5*step*decay)
+        full = applyBoundary(full, yn, boundary)
+        half = applyBoundary(half, yn, boundary)
+        gh = G(half, tn + 0.5*step)*scale
+        double = half + f(half, tn + 0.5*step, pars)*0.5*step + gh*dW2
+        if GdG is not None:
+            double += GdG(half, tn + 0.5*step)*h*(dW2**2 - 0.5*step)
+        if decay is not None:
+            double = (double + 0.5*step*decay*half)/(1. + 0.5*step*decay)
+        double = applyBoundary(double, half, boundary)
+        error = np.max(np.abs(double - full)/(atol + rtol*np.maximum(np.abs(yn), np.abs(double))))
+        steps += 1
+        if error <= 1. or step <= minStep:
+            tnext = tn + step
+            if len(pending) == 0 and times[-1] - tnext <= eps:
+                tnext = times[-1]
+            # Recorded time points passed by the step
+            end = k
+            while end < len(times) and times[end] - tnext <= eps:
+                end += 1
+            if end > k:
+                middle = k
+                while middle < end and times[middle] - (tn + 0.5*step) <= eps:
+                    middle += 1
+                if middle > k:
+                    y[k:middle] = bridgeStates(times[k:middle], tn, 0.5*step, yn, half,
+                                               gn, dW1, normals, boundary)
+                if end > middle:
+                    y[middle:end] = bridgeStates(times[middle:end], tn + 0.5*step, 0.5*step,
+                                                 half, double, gh, dW2, normals, boundary)
+                # The last recorded state is the state of the simulation
+                if abs(times[end - 1] - tnext) <= eps:
+                    y[end - 1] = double
+                k = end
+            yn = double
+            tn = tnext
+            if len(pending) == 0:
+                dt = step*min(2., 0.9/np.sqrt(max(error, 0.25)))
+            if reject is not None and k > checked and (k - checked >= max(1, chunk_size // record_every)\
+                                                      or k == len(times)):
+                if reject(y[checked:k]):
+                    return y, True, steps
+                checked = k
+        else:
+            pending.append((0.5*step, dW2))
+            pending.append((0.5*step, dW1))
+            dt = max(minStep, step*max(0.2, 0.9/np.sqrt(error)))
+    if reject is not None:
+        return y, False, steps
+    return y
+
+def bridgeStates(times, t0, step, y0, y1, g, dW, normals, boundary='hold'):
+    """
+    States at times within an integration step from t0 to t0 + step,
+    from y0 to y1 with noise amplitude g and Wiener increment dW, used
+    by eulersdeAdaptive(). The states are interpolated linearly between
+    y0 and y1, plus the noise of the Brownian bridge from 0 at t0 to dW
+    at t0 + step, minus its linear interpolation. This difference is
+    B(r) - r/step*B(step), for a Brownian motion B sampled at the times
+    r after t0, and at step.
+
+    :param times: Increasing times in (t0, t0 + step]
+    :type times: ndarray
+    :param t0: Start of the step
+    :type t0: float
+    :param step: Length of the step
+    :type step: float
+    :param y0: State at t0
+    :type y0: ndarray
+    :param y1: State at t0 + step
+    :type y1: ndarray
+    :param g: Noise amplitude of each state variable during the step
+    :type g: ndarray
+    :param dW: Wiener increment of the step
+    :type dW: ndarray
+    :param normals: Source of the normal vectors
+    :type normals: NormalStream
+    :param boundary: Policy used to keep state variables positive, see applyBoundary()
+    :type boundary: str
+    :returns:
+        - y: Array of shape (len(times), len(y0))
+    """
+    n = len(times)
+    r = np.empty(n + 1)
+    np.minimum(np.asarray(times) - t0, step, out=r[:n])
+    r[n] = step
+    increments = np.empty(n + 1)
+    increments[0] = r[0]
+    np.subtract(r[1:], r[:n], out=increments[1:])
+    B = np.cumsum(np.sqrt(np.maximum(increments, 0.))[:, None]*normals.take(n + 1), axis=0)
+    u = (r[:n]/step)[:, None]
+    return applyBoundary(y0 + u*(y1 - y0) + g*(B[:n] - u*B[n]), y0, boundary)
+
+def simulateModel(Model, y0, parameters,isStochastic, tspan,rng,boundary='hold',
+                  chunk_size=1000,record_every=1,jacobian=None,reject=None,
+                  integrator='euler',rtol=1e-2,atol=1e-2,milstein=False,decay=None):
     """Call numerical integration functions, either odeint() from Scipy,
     or simulator.eulersde() defined in simulator.py. By default, stochastic simulations are
     carried out using simulator.eulersde.
@@ -77,19 +539,146 @@ def simulateModel(Model, y0, parameters,isStochastic, tspan,seed):
     :type isStochastic: bool
     :param tspan: Time points to simulate
     :type tspan: ndarray
-    :param seed: Seed to initialize random number generator
-    :type seed: float
+    :param rng: Random number generator of the simulated cell
+    :type rng: numpy.random.Generator
+    :param boundary: Policy used to keep state variables positive, see applyBoundary()
+    :type boundary: str
+    :param chunk_size: Number of time steps for which Wiener increments are generated at once
+    :type chunk_size: int
+    :param record_every: Only every record_every-th time point is returned
+    :type record_every: int
+    :param jacobian: Function computing the Jacobian of Model, used by odeint(). If None, odeint() uses finite differences.
+    :type jacobian: function
+    :param reject: Rejection predicate of stochastic simulations, see eulersde()
+    :type reject: function
+    :param integrator: Integrator of stochastic simulations, 'euler' for eulersde() or 'adaptive' for eulersdeAdaptive()
+    :type integrator: str
+    :param rtol: Relative tolerance of the adaptive integrator
+    :type rtol: float
+    :param atol: Absolute tolerance of the adaptive integrator
+    :type atol: float
+    :param milstein: Use the Milstein scheme, which adds the correction of noiseCorrection() to each step
+    :type milstein: bool
+    :param decay: Rates of the linear degradation terms which are integrated implicitly, see eulersde(). If None, all terms are integrated explicitly.
+    :type decay: ndarray
     :returns: 
-        - P: Time course from numerical integration
+        - P: Time course from numerical integration. If reject is given, a tuple (P, rejected, steps) is returned, see eulersde().
     :rtype: ndarray
 
     """
     if not isStochastic:
-        P = odeint(Model,y0,tspan,args=(parameters,))
+        P = odeint(Model,y0,tspan,args=(parameters,),Dfun=jacobian)[::record_every]
+        if reject is not None:
+            # Deterministic simulations are never aborted
+            P = (P, False, len(tspan) - 1)
+    elif integrator == 'adaptive':
+        P = eulersdeAdaptive(Model,noise,y0,tspan,parameters,rng=rng,boundary=boundary,
+                             chunk_size=chunk_size,record_every=record_every,reject=reject,
+                             rtol=rtol,atol=atol,GdG=noiseCorrection if milstein else None,
+                             decay=decay)
+    elif integrator == 'euler':
+        P = eulersde(Model,noise,y0,tspan,parameters,rng=rng,boundary=boundary,
+                     chunk_size=chunk_size,record_every=record_every,reject=reject,
+                     GdG=noiseCorrection if milstein else None,decay=decay)
     else:
-        P = eulersde(Model,noise,y0,tspan,parameters,seed=seed)
+        raise ValueError("integrator should be one of ['euler', 'adaptive'], got "\
+                         + str(integrator))
     return(P)
 
+def simulateModelEnsemble(Model, y0, parameters, tspan, rngs, boundary='hold',
+                          chunk_size=1000, record_every=1, reject=None, milstein=False,
+                          decay=None):
+    """Carry out stochastic simulations of an ensemble of cells
+    using simulator.eulersdeEnsemble().
+
+    :param Model: Function defining ODE model
+    :type Model: function
+    :param y0: array of initial values of each cell, of shape (num_cells, d)
+    :type y0: ndarray
+    :param parameters: Parameter values to be used in simulations, either a vector shared by all cells, or an array of shape (number of parameters, num_cells) with one column per cell
+    :type parameters: ndarray
+    :param tspan: Time points to simulate
+    :type tspan: ndarray
+    :param rngs: Random number generators, one per cell
+    :type rngs: list
+    :param boundary: Policy used to keep state variables positive, see applyBoundary()
+    :type boundary: str
+    :param chunk_size: Number of time steps for which Wiener increments are generated at once
+    :type chunk_size: int
+    :param record_every: Only every record_every-th time point is returned
+    :type record_every: int
+    :param reject: Rejection predicate, see eulersdeEnsemble()
+    :type reject: function
+    :param milstein: Use the Milstein scheme, see simulateModel()
+    :type milstein: bool
+    :param decay: Rates of the linear degradation terms which are integrated implicitly, see eulersdeEnsemble()
+    :type decay: ndarray
+    :returns:
+        - P: Time course of each cell, of shape (len(tspan[::record_every]), num_cells, d). If reject is given, a tuple (P, rejected, steps) is returned, see eulersdeEnsemble().
+    :rtype: ndarray
+    """
+    P = eulersdeEnsemble(Model,noise,y0,tspan,parameters,rngs,boundary=boundary,
+                         chunk_size=chunk_size,record_every=record_every,reject=reject,
+                         GdG=noiseCorrection if milstein else None,decay=decay)
+    return(P)
+
+def simulateDeterministic(Model, y0, parameters, tspan, jacobian=None, sparsity=None,
+                          record_every=1, rtol=1e-6, atol=1e-9):
+    """Integrates the ODE model, without noise, from several initial
+    conditions and/or parameter sets at once. The systems are stacked
+    into a single system with num_runs*d variables, which is integrated
+    by one call of scipy.integrate.solve_ivp() with the BDF method, and
+    whose right hand side is evaluated by one vectorized call of Model.
+    The Jacobian of the stacked system is block diagonal, with one
+    block per run.
+
+    :param Model: Function defining ODE model, accepting a state array of shape (d, num_runs)
+    :type Model: function
+    :param y0: Initial values of each run, of shape (num_runs, d)
+    :type y0: ndarray
+    :param parameters: Parameter values, either a vector shared by all runs, or an array of shape (number of parameters, num_runs)
+    :type parameters: ndarray
+    :param tspan: Time points to simulate
+    :type tspan: ndarray
+    :param jacobian: Function computing the Jacobian of Model, called like Model, and returning an array of shape (d, d, num_runs), e.g. CompiledModel.jacobian. If None, the Jacobian is approximated by finite differences.
+    :type jacobian: function
+    :param sparsity: Sparsity pattern of the Jacobian of a single run, of shape (d, d), used for the finite difference approximation if jacobian is None.
+    :type sparsity: scipy.sparse matrix
+    :param record_every: Only every record_every-th time point is returned
+    :type record_every: int
+    :param rtol: Relative tolerance of the integrator
+    :type rtol: float
+    :param atol: Absolute tolerance of the integrator
+    :type atol: float
+    :returns:
+        - P: Time course of each run, of shape (len(tspan[::record_every]), num_runs, d)
+    :rtype: ndarray
+    """
+    y0 = np.asarray(y0, dtype=float)
+    numRuns, d = y0.shape
+    parameters = np.asarray(parameters, dtype=float)
+    def rhs(t, z):
+        # The model expects one row per state variable
+        return Model(z.reshape(numRuns, d).T, t, parameters).T.ravel()
+    options = {}
+    if jacobian is not None:
+        def jac(t, z):
+            J = jacobian(z.reshape(numRuns, d).T, t, parameters)
+            return sparse.bsr_matrix((np.ascontiguousarray(J.transpose(2, 0, 1)),
+                                      np.arange(numRuns), np.arange(numRuns + 1)),
+                                     shape=(numRuns*d, numRuns*d))
+        options['jac'] = jac
+    elif sparsity is not None:
+        options['jac_sparsity'] = sparse.block_diag([sparsity]*numRuns, format='csr')
+    times = np.asarray(tspan, dtype=float)[::record_every]
+    # The step size control of solve_ivp underflows harmlessly
+    with np.errstate(under='ignore'):
+        solution = solve_ivp(rhs, (tspan[0], tspan[-1]), y0.ravel(), method='BDF',
+                             t_eval=times, rtol=rtol, atol=atol, **options)
+    if not solution.success:
+        raise RuntimeError("Deterministic simulation failed: " + solution.message)
+    return solution.y.reshape(numRuns, d, len(times)).transpose(2, 0, 1)
+
 def getInitialCondition(ss, ModelSpec, rnaIndex,
                         proteinIndex,
                         genelist, proteinlist,
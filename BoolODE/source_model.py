@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+class SourceModel:
+    """The Model() function generated by GenerateModel, compiled in memory.
+
+    The source code of Model() is compiled once, without writing it to
+    model.py and importing it. Instances are pickled as their source code,
+    and compiled again when unpickled, so that a model can be sent to
+    worker processes irrespective of how these are started.
+
+    An instance is called exactly like Model().
+
+    :param source: Source code defining Model(), see GenerateModel.getModelSource()
+    :type source: str
+    """
+    def __init__(self, source) -> None:
+        self.source = source
+        namespace = {}
+        exec(compile(source, '<BoolODE model>', 'exec'), namespace)
+        self.function = namespace['Model']
+
+    def __reduce__(self):
+        return (SourceModel, (self.source,))
+
+    def __call__(self, Y, t, pars):
+        """
+        Computes the time derivatives of the model.
+
+        :param Y: Current model state
+        :type Y: ndarray
+        :param t: Current time
+        :type t: float
+        :param pars: List of parameter values, sorted by parameter name
+        :type pars: list
+        :returns:
+            - dY: Time derivatives
+        """
+        return self.function(Y, t, pars)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+from scipy import sparse
+# local imports
+from BoolODE import utils
+from BoolODE.compiled_model import KineticModel
+
+class SparseModel(KineticModel):
+    """Implementation of the ODE model constructed by GenerateModel whose
+    cost grows with the number of regulatory interactions.
+
+    The regulatory function of a node is the probability that its Boolean
+    rule is true, if each regulator is independently ON with probability
+    q = h/(1+h), where h is the Hill function of the regulator
+    (see GenerateModel.createCompactHillFunction()). Unlike the expanded
+    Hill and Heaviside expressions, which have a term for every
+    combination of regulators, this probability is a product/sum
+    expression whose size follows the size of the rule
+    (see utils.ruleProbabilityTree()).
+
+    Each Hill function is evaluated once per step for every distinct
+    (regulator, threshold, Hill coefficient), and is shared by all
+    targets of the regulator. The regulatory graph is stored as a sparse
+    matrix with one row per node and one column per Hill function. The
+    expressions of all nodes are merged into a single graph of operations,
+    in which shared subexpressions are evaluated once, and the operations
+    of the same kind at the same depth are evaluated together.
+
+    In the Heaviside model, the sum over all combinations of regulators
+    is obtained from the same probability, with q = p/(1+p):
+    sum_S w_S prod_S p = omega*(prod(1+p)*(2P - 1) + 1 - 2P_0),
+    where P_0 is the value of the rule when all regulators are OFF.
+
+    Both identities hold when the logic parameters 'a' and 'w' take their
+    default values, which are not read by this model. The derivatives are
+    the same as those of CompiledModel. The Jacobian is not computed
+    analytically, only its sparsity pattern is provided.
+
+    :param mg: Model details obtained by instantiating an object of GenerateModel
+    :type mg: BoolODE.GenerateModel
+    """
+    def __init__(self, mg) -> None:
+        self.modeltype = mg.settings['modeltype']
+        self.parNames = sorted(mg.ModelSpec['pars'].keys())
+        parindex = {p:i for i, p in enumerate(self.parNames)}
+        varindex = {v:i for i, v in mg.varmapper.items()}
+        self.numVars = len(varindex)
+        nodes = list(mg.regulation.keys())
+
+        ## Hill functions, one per (regulator, threshold, Hill coefficient)
+        activations = {}
+        speciesActivations, speciesSource = [], []
+        inputActivations, inputSource = [], []
+        threshold, hillCoefficient = [], []
+        graphRows, graphCols = [], []
+        trees = []
+        for ni, node in enumerate(nodes):
+            regulation = mg.regulation[node]
+            leaves = {}
+            for reg in regulation['regulators']:
+                if self.modeltype == 'hill':
+                    key = (reg, mg.getHillThresholdName(node, reg))
+                else:
+                    key = (reg,)
+                if key not in activations:
+                    activations[key] = len(activations)
+                    if reg in regulation['species']:
+                        speciesActivations.append(activations[key])
+                        speciesSource.append(varindex['p_' + reg])
+                    else:
+                        inputActivations.append(activations[key])
+                        inputSource.append(parindex[reg])
+                    if self.modeltype == 'hill':
+                        threshold.append(parindex[key[1]])
+                        hillCoefficient.append(parindex['n_' + reg])
+                leaves[reg] = activations[key]
+                graphRows.append(ni)
+                graphCols.append(activations[key])
+            trees.append((leaves, utils.ruleProbabilityTree(regulation['rule'],
+                                                            regulation['regulators'])))
+        self.numActivations = len(activations)
+        self.speciesActivations = np.array(speciesActivations, dtype=int)
+        self.speciesSource = np.array(speciesSource, dtype=int)
+        self.inputActivations = np.array(inputActivations, dtype=int)
+        self.inputSource = np.array(inputSource, dtype=int)
+        self.threshold = np.array(threshold, dtype=int)
+        self.hillCoefficient = np.array(hillCoefficient, dtype=int)
+        self.graph = sparse.csr_matrix((np.ones(len(graphRows)), (graphRows, graphCols)),
+                                       shape=(len(nodes), self.numActivations))
+
+        ## Graph of operations
+        # Values are stored in one array: the Hill functions,
+        # the constants 0 and 1, and the results of the operations
+        self.zero = self.numActivations
+        self.one = self.numActivations + 1
+        base = self.numActivations + 2
+        operations, level, interned = [], [], {}
+        def intern(tree, leaves):
+            if tree == 0:
+                return self.zero, 0
+            elif tree == 1:
+                return self.one, 0
+            elif tree[0] == 'q':
+                return leaves[tree[1]], 0
+            children = [intern(c, leaves) for c in (tree[1:] if tree[0] == 'not' else tree[1])]
+            key = (tree[0], tuple([c for c, _ in children]))
+            if key not in interned:
+                interned[key] = base + len(operations)
+                operations.append(key)
+                level.append(1 + max([l for _, l in children]))
+            return interned[key], level[interned[key] - base]
+        self.root = np.array([intern(tree, leaves)[0] for leaves, tree in trees], dtype=int)
+        # Operations are renumbered so that the operations
+        # of the same kind at the same depth are contiguous
+        kinds = ['not', 'mul', 'sum']
+        order = sorted(range(len(operations)),
+                       key=lambda o: (level[o], kinds.index(operations[o][0])))
+        renumber = np.arange(base + len(operations))
+        renumber[base + np.array(order, dtype=int)] = base + np.arange(len(operations))
+        self.root = renumber[self.root]
+        self.numValues = base + len(operations)
+        self.schedule = []
+        start = 0
+        while start < len(order):
+            kind, l = operations[order[start]][0], level[order[start]]
+            stop = start
+            while stop < len(order) and level[order[stop]] == l\
+                  and operations[order[stop]][0] == kind:
+                stop += 1
+            width = max([len(operations[o][1]) for o in order[start:stop]])
+            # Products are padded with the constant 1, and sums with the constant 0
+            children = np.full((stop - start, width),
+                               self.one if kind == 'mul' else self.zero, dtype=int)
+            for i, o in enumerate(order[start:stop]):
+                children[i, :len(operations[o][1])] = renumber[list(operations[o][1])]
+            self.schedule.append((kind, base + start, base + stop, children))
+            start = stop
+
+        if self.modeltype == 'heaviside':
+            self.sigmaH = np.array([parindex['sigmaH_' + node] for node in nodes], dtype=int)
+            self.basal = np.array([parindex[mg.regulation[node]['basal']] for node in nodes], dtype=int)
+            self.omega = mg.kineticParameterDefaults['heavisideOmega']
+            # Value of each rule when all regulators are OFF
+            self.ruleOff = np.array([float(utils.truthTable(mg.regulation[node]['rule'],
+                                                            mg.regulation[node]['regulators'])[0])
+                                     for node in nodes])
+        self.indexKinetics(mg, nodes, parindex, varindex)
+
+    def regulatoryFunctions(self, Y, pars):
+        """
+        Evaluates the regulatory function of every node in the model.
+
+        :param Y: Current model state, one row per state variable
+        :type Y: ndarray
+        :param pars: Parameter values, broadcastable against Y
+        :type pars: ndarray
+        :returns:
+            - f: Array with one row per node, with values between 0 and 1
+        """
+        A = self.numActivations
+        values = np.empty((self.numValues,) + Y.shape[1:])
+        values[self.speciesActivations] = Y[self.speciesSource]
+        values[self.inputActivations] = pars[self.inputSource]
+        if self.modeltype == 'hill':
+            values[:A] = (values[:A]/pars[self.threshold])**pars[self.hillCoefficient]
+        elif self.modeltype == 'heaviside':
+            # Product of (1 + p) over the regulators of each node
+            scale = np.exp(self.graph @ np.log1p(values[:A]))
+        # Probability of each regulator to be ON
+        values[:A] = values[:A]/(1. + values[:A])
+        values[self.zero] = 0.
+        values[self.one] = 1.
+        for kind, start, stop, children in self.schedule:
+            if kind == 'not':
+                values[start:stop] = 1. - values[children[:, 0]]
+            elif kind == 'mul':
+                values[start:stop] = values[children].prod(axis=1)
+            elif kind == 'sum':
+                values[start:stop] = values[children].sum(axis=1)
+        f = values[self.root]
+        if self.modeltype == 'hill':
+            return f
+        elif self.modeltype == 'heaviside':
+            ruleOff = self.ruleOff.reshape(self.ruleOff.shape + (1,)*(Y.ndim - 1))
+            weighted = self.omega*(scale*(2.*f - 1.) + 1. - 2.*ruleOff)
+            exponent = -pars[self.sigmaH]*(pars[self.basal] + weighted)
+            return 1./(1. + np.exp(np.clip(exponent, -10., 10.)))
+
+    def jacobianSparsity(self):
+        """
+        Returns the sparsity pattern of the Jacobian, which follows
+        the regulatory graph.
+
+        :returns:
+            - pattern: Sparse boolean matrix of shape (d, d), True where J[i, j] can be nonzero
+        """
+        graph = self.graph.tocoo()
+        source = np.full(self.numActivations, -1, dtype=int)
+        source[self.speciesActivations] = self.speciesSource
+        keep = source[graph.col] >= 0
+        rows = np.concatenate([self.geneX, self.geneP, self.geneP,
+                               self.proteinP, self.nodeRow[graph.row[keep]]])
+        cols = np.concatenate([self.geneX, self.geneX, self.geneP,
+                               self.proteinP, source[graph.col[keep]]])
+        pattern = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                    shape=(self.numVars, self.numVars))
+        pattern.sum_duplicates()
+        return pattern
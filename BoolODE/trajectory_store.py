@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+class TrajectoryStore:
+    """Binary storage for the simulated trajectories of a job.
+
+    Instead of one text file per cell, all trajectories are stored in a
+    single .npy file holding an array of shape (genes, time points, cells).
+    The file is memory-mapped, so that readers only load the values
+    they access.
+    The gene names and time points are stored in a JSON sidecar file.
+
+    :param path: Path to the simulations folder of the job
+    :type path: str or Path
+    """
+    def __init__(self, path) -> None:
+        self.path = Path(path)
+        self.arrayPath = self.path / 'trajectories.npy'
+        self.metadataPath = self.path / 'trajectories.json'
+        self.metadata = dict()
+        self._array = None
+
+    def exists(self):
+        """
+        Returns True if a trajectory store has been written to path.
+        """
+        return self.arrayPath.is_file() and self.metadataPath.is_file()
+
+    def remove(self):
+        """
+        Deletes the store, if it exists.
+        """
+        for path in [self.arrayPath, self.metadataPath]:
+            if path.is_file():
+                path.unlink()
+
+    def create(self, genes, timepoints, num_cells):
+        """
+        Creates an empty store, overwriting any existing store.
+
+        :param genes: Names of the genes, in the order in which they are written
+        :type genes: list
+        :param timepoints: Indices of the stored time points
+        :type timepoints: list
+        :param num_cells: Number of simulated cells
+        :type num_cells: int
+        """
+        self.metadata = {'genes':list(genes),
+                         'timepoints':[int(t) for t in timepoints],
+                         'num_cells':int(num_cells)}
+        with open(self.metadataPath, 'w') as out:
+            json.dump(self.metadata, out)
+        array = np.lib.format.open_memmap(self.arrayPath, mode='w+', dtype=float,
+                                          shape=(len(genes), len(timepoints), num_cells))
+        array.flush()
+        del array
+        self._array = None
+
+    def save(self, genes, timepoints, trajectories):
+        """
+        Creates the store and writes the trajectories of all cells at once.
+
+        :param genes: Names of the genes, in the order of the rows of trajectories
+        :type genes: list
+        :param timepoints: Indices of the stored time points
+        :type timepoints: list
+        :param trajectories: Array of shape (genes, time points, cells)
+        :type trajectories: ndarray
+        """
+        self.create(genes, timepoints, trajectories.shape[2])
+        array = self.open(mode='r+')
+        array[:] = trajectories
+        array.flush()
+
+    def open(self, mode='r'):
+        """
+        Reads the metadata and memory-maps the trajectories.
+
+        :param mode: 'r' to read the store, 'r+' to write to it
+        :type mode: str
+        :returns:
+            - array: Memory-mapped array of shape (genes, time points, cells)
+        """
+        with open(self.metadataPath, 'r') as infile:
+            self.metadata = json.load(infile)
+        self._array = np.load(self.arrayPath, mmap_mode=mode)
+        return self._array
+
+    def read(self):
+        """
+        Returns the memory-mapped array of all trajectories,
+        of shape (genes, time points, cells).
+        """
+        if self._array is None:
+            self.open()
+        return self._array
+
+    def sample(self, cellids, timepoints):
+        """
+        Returns the expression of the given cells at the given time
+        points as a DataFrame with genes as rows, sorted by name, and
+        one column 'E<cellid>_<timepoint>' per sample.
+
+        :param cellids: IDs of the simulated cells
+        :type cellids: list
+        :param timepoints: Index of the time point sampled from each cell
+        :type timepoints: list
+        """
+        array = self.read()
+        timeIndex = {t:i for i, t in enumerate(self.metadata['timepoints'])}
+        values = array[:, [timeIndex[t] for t in timepoints], cellids]
+        df = pd.DataFrame(values, index=pd.Index(self.metadata['genes']),
+                          columns=['E' + str(cid) + '_' + str(t)\
+                                   for cid, t in zip(cellids, timepoints)])
+        return df.sort_index()
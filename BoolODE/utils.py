@@ -1,10 +1,39 @@
 import os
 import sys
+import ast
 import yaml
 import numpy as np
 import pandas as pd
+from scipy import special
 from pathlib import Path
 
+# Keys identifying the independent streams of random
+# numbers used by a job, see getGenerator()
+PARAMETER_STREAM = 0
+CELL_STREAM = 1
+SAMPLING_STREAM = 2
+GENSAMPLES_STREAM = 3
+DROPOUT_STREAM = 4
+ATTRACTOR_STREAM = 5
+
+def getGenerator(seed, *key):
+    """
+    Returns a random number generator for one stream of random numbers
+    used by a job. Each stream is identified by a key, for instance
+    (CELL_STREAM, cellid), and is derived from the job seed using a
+    numpy SeedSequence. Thus, the numbers drawn from a stream depend only
+    on the job seed and the key, and not on whether the cells are simulated
+    serially, in parallel or as an ensemble.
+
+    :param seed: The seed of the job
+    :type seed: int
+    :param key: Integers identifying the stream
+    :type key: int
+    :returns:
+        - rng: numpy.random.Generator for the stream
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=key))
+
 
 def heavisideThreshold(value):
     """
@@ -77,11 +106,268 @@ def getRegulatorsInRule(rule, species, inputs):
 
     return((allreg, regulatorySpecies, inputreg))
 
+def compileRule(rule):
+    """
+    Parses a Boolean rule once, and compiles it into an expression
+    that can be evaluated on arrays of truth values. Rules are written
+    using the Python operators and, or and not, which are replaced
+    by the elementwise operators &, | and ~.
+
+    :param rule: Boolean rule, e.g. 'g1 and not (g2 or g3)'
+    :type rule: str
+    :returns:
+        - code: Compiled expression, see evaluateRule()
+        - names: Set of names of the nodes appearing in the rule
+    """
+    names = set()
+    def vectorize(node):
+        if isinstance(node, ast.BoolOp):
+            op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+            values = [vectorize(v) for v in node.values]
+            expression = values[0]
+            for value in values[1:]:
+                expression = ast.BinOp(left=expression, op=op, right=value)
+            return expression
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=vectorize(node.operand))
+        elif isinstance(node, ast.Name):
+            names.add(node.id)
+            return node
+        elif isinstance(node, ast.Constant):
+            # Constants are replaced by numpy booleans,
+            # on which ~ is a logical negation
+            return ast.Name(id='__true__' if node.value else '__false__', ctx=ast.Load())
+        raise ValueError("Unsupported expression in Boolean rule '" + rule + "': "\
+                         + ast.dump(node))
+    tree = ast.parse(rule.strip(), mode='eval')
+    tree = ast.Expression(body=vectorize(tree.body))
+    code = compile(ast.fix_missing_locations(tree), '<rule>', 'eval')
+    return code, names
+
+def evaluateRule(code, names, values):
+    """
+    Evaluates a rule compiled by compileRule(). Nodes missing
+    from values are OFF.
+
+    :param code: Compiled expression returned by compileRule()
+    :type code: code
+    :param names: Names of the nodes appearing in the rule, returned by compileRule()
+    :type names: set
+    :param values: Mapper: {node name : boolean ndarray of node states}
+    :type values: dict
+    :returns:
+        - result: The value of the rule for every set of node states
+    """
+    namespace = {n:np.False_ for n in names}
+    namespace.update({n:v for n, v in values.items() if n in names})
+    namespace['__true__'] = np.True_
+    namespace['__false__'] = np.False_
+    return eval(code, {'__builtins__':{}}, namespace)
+
+def truthTable(rule, regulators):
+    """
+    Evaluates a Boolean rule for all combinations of states
+    of its regulators at once. All other nodes are OFF.
+
+    :param rule: Boolean rule
+    :type rule: str
+    :param regulators: List of regulators
+    :type regulators: list
+    :returns:
+        - table: Boolean array of length 2^len(regulators). Entry m is the value of the rule when regulators[j] is ON if and only if bit j of m is set.
+    """
+    code, names = compileRule(rule)
+    numStates = 2**len(regulators)
+    states = (np.arange(numStates)[:, None] >> np.arange(len(regulators))) & 1
+    values = {r:states[:, j].astype(bool) for j, r in enumerate(regulators)}
+    table = evaluateRule(code, names, values)
+    return np.array(np.broadcast_to(table, (numStates,)), dtype=bool)
+
+def disjointCover(table, numRegulators):
+    """
+    Splits the states of the regulators for which a Boolean rule is true
+    into disjoint cubes, i.e. sets of states in which some regulators
+    have a fixed state and the others are free. The truth table is
+    expanded about one regulator after the other, starting from the
+    last, and the expansion stops as soon as the rule is constant.
+    Regulators which the rule does not depend on are skipped.
+    Thus, an 'and' of k regulators gives one cube, and an 'or' gives
+    k cubes, instead of the 2^k - 1 states for which it is true.
+
+    :param table: Truth table of the rule, see truthTable()
+    :type table: ndarray
+    :param numRegulators: Number of regulators of the rule
+    :type numRegulators: int
+    :returns:
+        - cubes: List of cubes, each a list of (index of the regulator, state) pairs
+    """
+    cubes = []
+    def expand(values, literals, j):
+        # Axis 0 of values is the state of regulator j
+        if values.all():
+            cubes.append(literals)
+        elif values.any():
+            off, on = values[0], values[1]
+            if np.array_equal(off, on):
+                expand(off, literals, j - 1)
+            else:
+                expand(on, literals + [(j, True)], j - 1)
+                expand(off, literals + [(j, False)], j - 1)
+    expand(np.asarray(table, dtype=bool).reshape((2,)*numRegulators), [], numRegulators - 1)
+    return cubes
+
+def ruleProbabilityTree(rule, regulators):
+    """
+    Constructs the probability that a Boolean rule is true, when
+    each regulator r is independently ON with probability q_r.
+    All other nodes are OFF.
+    The probability is factored following the structure of the rule:
+    the operands of 'and' and 'or' that share no regulators are
+    independent, so that their probabilities are multiplied. If operands
+    share a regulator r, the probability is expanded about r as
+    P = q_r*P(rule | r ON) + (1 - q_r)*P(rule | r OFF).
+    Thus, the size of the result is linear in the size of the
+    rule if every regulator appears only once in it.
+
+    :param rule: Boolean rule
+    :type rule: str
+    :param regulators: Names of the regulators
+    :type regulators: list
+    :returns:
+        - tree: The probability as a nested tuple. Leaves are the constants 0 and 1, and ('q', r) for the probability of regulator r. Inner nodes are ('not', x) for 1 - x, and ('mul', (x, y, ...)) and ('sum', (x, y, ...)) for products and sums.
+    """
+    def substitute(node, name, value):
+        if isinstance(node, ast.Name) and node.id == name:
+            return ast.Constant(value=value)
+        elif isinstance(node, ast.BoolOp):
+            return ast.BoolOp(op=node.op, values=[substitute(v, name, value) for v in node.values])
+        elif isinstance(node, ast.UnaryOp):
+            return ast.UnaryOp(op=node.op, operand=substitute(node.operand, name, value))
+        return node
+
+    def names(node):
+        return set([n.id for n in ast.walk(node) if isinstance(n, ast.Name)])
+
+    def complement(p):
+        if p in [0, 1]:
+            return 1 - p
+        if p[0] == 'not':
+            return p[1]
+        return ('not', p)
+
+    def product(factors):
+        if 0 in factors:
+            return 0
+        factors = tuple([f for f in factors if f != 1])
+        if len(factors) == 0:
+            return 1
+        elif len(factors) == 1:
+            return factors[0]
+        return ('mul', factors)
+
+    def probability(node):
+        if isinstance(node, ast.Constant):
+            return 1 if node.value else 0
+        elif isinstance(node, ast.Name):
+            return ('q', node.id)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return complement(probability(node.operand))
+        elif isinstance(node, ast.BoolOp):
+            counts = {}
+            for value in node.values:
+                for reg in names(value):
+                    counts[reg] = counts.get(reg, 0) + 1
+            shared = sorted([reg for reg, c in counts.items() if c > 1])
+            if len(shared) > 0:
+                # Expand about the most frequent shared regulator
+                reg = max(shared, key=lambda r: counts[r])
+                on = probability(substitute(node, reg, True))
+                off = probability(substitute(node, reg, False))
+                if on == off:
+                    return on
+                terms = [t for t in [product([('q', reg), on]),
+                                     product([complement(('q', reg)), off])] if t != 0]
+                if len(terms) == 1:
+                    return terms[0]
+                return ('sum', tuple(terms))
+            operands = [probability(v) for v in node.values]
+            if isinstance(node.op, ast.And):
+                return product(operands)
+            else:
+                return complement(product([complement(p) for p in operands]))
+        raise ValueError("Unsupported expression in Boolean rule '" + rule + "': "\
+                         + ast.dump(node))
 
-def getSaneNval(size,lo=1.,hi=10.,mu=2.,sig=2.,identicalPars=False):
+    tree = ast.parse(rule.strip(), mode='eval').body
+    # Nodes that are not regulators are OFF
+    for name in names(tree).difference(regulators):
+        tree = substitute(tree, name, False)
+    return probability(tree)
+
+def ruleProbability(rule, probabilities):
+    """
+    Constructs an expression for the probability that a Boolean rule
+    is true, when each regulator is independently ON with a given
+    probability, see ruleProbabilityTree().
+
+    :param rule: Boolean rule
+    :type rule: str
+    :param probabilities: Mapper: {regulator : expression for the probability that the regulator is ON}
+    :type probabilities: dict
+    :returns:
+        - expression: Expression for the probability that the rule is true
+    """
+    def render(p):
+        if p in [0, 1]:
+            return str(p)
+        elif p[0] == 'q':
+            return probabilities[p[1]]
+        elif p[0] == 'not':
+            return '(1-' + render(p[1]) + ')'
+        elif p[0] == 'mul':
+            return '*'.join([render(f) for f in p[1]])
+        elif p[0] == 'sum':
+            return '(' + ' + '.join([render(t) for t in p[1]]) + ')'
+    return render(ruleProbabilityTree(rule, list(probabilities.keys())))
+
+def truncatedNormal(size, lo, hi, mu, sig, rng=None):
+    """
+    Draws samples from normal distributions truncated to [lo, hi], by
+    inverting the cumulative distribution function of each distribution
+    on uniform samples. All samples are drawn at once, without rejection.
+    The bounds, means and standard deviations are broadcast against size,
+    so that each column can follow a different distribution.
+
+    :param size: Shape of the returned array
+    :type size: int or tuple
+    :param lo: Lower bounds of the sample ranges
+    :type lo: float or ndarray
+    :param hi: Upper bounds of the sample ranges
+    :type hi: float or ndarray
+    :param mu: Means of the Gaussian distributions
+    :type mu: float or ndarray
+    :param sig: Standard deviations of the Gaussian distributions
+    :type sig: float or ndarray
+    :param rng: Random number generator. If None, a freshly seeded generator is used.
+    :type rng: numpy.random.Generator
+    :returns:
+        - K: Array of sampled values
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    lo, hi, mu, sig = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (lo, hi, mu, sig)])
+    # A distribution with zero width is a point mass at its mean
+    scale = np.where(sig > 0, sig, 1.)
+    cdfLo = special.ndtr((lo - mu)/scale)
+    cdfHi = special.ndtr((hi - mu)/scale)
+    u = rng.uniform(size=size)
+    K = mu + scale*special.ndtri(cdfLo + u*(cdfHi - cdfLo))
+    return np.where(sig > 0, np.clip(K, lo, hi), np.clip(mu, lo, hi))
+
+def getSaneNval(size,lo=1.,hi=10.,mu=2.,sig=2.,identicalPars=False,rng=None):
     """
     Generates a gaussian random number which is
-    bounded by `lo` and `hi`
+    bounded by `lo` and `hi`, see truncatedNormal()
 
     :param size: number of random numbers to generate
     :type size: int
@@ -95,22 +381,16 @@ def getSaneNval(size,lo=1.,hi=10.,mu=2.,sig=2.,identicalPars=False):
     :type sigma: float
     :param identicalPars: Flag to sample single value and return a list of identical values
     :type identicalPars: bool
+    :param rng: Random number generator. If None, a freshly seeded generator is used.
+    :type rng: numpy.random.Generator
     :returns:
         - K: list of sampled values
     """
-    
     if identicalPars:
-        k = np.random.normal(mu, sig)
-        while k < lo or k > hi:
-            k = np.random.normal(mu, sig)
+        k = float(truncatedNormal(1, lo, hi, mu, sig, rng)[0])
         K = [k for i in range(size)]
     else:
-        K = []
-        for _ in range(size):
-            k = np.random.normal(mu, sig)
-            while k < lo or k > hi:
-                k = np.random.normal(mu, sig)
-            K.append(k)
+        K = [float(k) for k in truncatedNormal(size, lo, hi, mu, sig, rng)]
     return K
 
 def minmaxnorm(X):
@@ -173,7 +453,7 @@ def get_ss(P):
 
 def generateInputFiles(resultDF, BoolDF, withoutRules,
                        parameterInputsDF,tmax,numcells,
-                       outPrefix=''):
+                       outPrefix='',rng=None):
     """
     Generates input files required from the Beeline pipeline
 
@@ -189,6 +469,8 @@ def generateInputFiles(resultDF, BoolDF, withoutRules,
     :type parameterInputsPath: str
     :param outPrefix: Prefix specifying target directory
     :type outPrefix: str (Optional)
+    :param rng: Random number generator used to sample cells from large datasets
+    :type rng: numpy.random.Generator (Optional)
     """
     
     print('1. refNetwork')
@@ -261,9 +543,15 @@ def generateInputFiles(resultDF, BoolDF, withoutRules,
     else:
         print("Dataset too large."
               "\nSampling %d cells, one from each simulated trajectory." % numcells)
-        times = np.random.choice([i for i in range(1,tmax*100)],numcells)
-        expdf = pd.DataFrame(columns=['E' + str(i) + '_' + str(times[i])\
-                                      for i in range(numcells)],
+        if rng is None:
+            rng = np.random.default_rng()
+        ## Only the recorded time points of each simulation
+        ## are columns of resultDF
+        recorded = {}
+        for c, e in zip(resultDF.columns, experiment):
+            recorded.setdefault(e, []).append(c)
+        choice = rng.integers(0, [len(recorded[i]) for i in range(numcells)])
+        expdf = pd.DataFrame(columns=[recorded[i][choice[i]] for i in range(numcells)],
                              index=resultDF.index)
         for c in expdf.columns:
             expdf[c] = resultDF[c]